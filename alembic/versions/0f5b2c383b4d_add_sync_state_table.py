@@ -0,0 +1,35 @@
+"""Add sync state table
+
+Revision ID: 0f5b2c383b4d
+Revises: 15ede7adf5e2
+Create Date: 2026-10-17 07:31:05.662380
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0f5b2c383b4d"
+down_revision: Union[str, None] = "15ede7adf5e2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sync_state",
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("watermark", sa.String(), nullable=True),
+        sa.Column("synced_at", sa.DateTime(), nullable=True),
+        sa.Column("reconciled_at", sa.DateTime(), nullable=True),
+        sa.Column("requests", sa.Integer(), nullable=False),
+        sa.Column("bytes", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("sync_state")
@@ -0,0 +1,26 @@
+"""Add asset fingerprint
+
+Revision ID: 15ede7adf5e2
+Revises: 1e1fd7b40042
+Create Date: 2026-10-17 07:21:48.904117
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "15ede7adf5e2"
+down_revision: Union[str, None] = "1e1fd7b40042"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("asset", sa.Column("fingerprint", sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("asset", "fingerprint")
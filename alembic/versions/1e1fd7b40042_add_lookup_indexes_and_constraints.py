@@ -0,0 +1,110 @@
+"""Add lookup indexes and constraints
+
+Revision ID: 1e1fd7b40042
+Revises: a1bb2f95d52a
+Create Date: 2026-10-17 07:04:12.530911
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "1e1fd7b40042"
+down_revision: Union[str, None] = "a1bb2f95d52a"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _dedupe() -> None:
+    # Repoint everything at the lowest id per natural key, then drop the rest
+    op.execute(
+        "UPDATE asset SET creator_id = ("
+        'SELECT min(u2.id) FROM "user" u1 JOIN "user" u2 ON u2.nickname = u1.nickname '
+        "WHERE u1.id = asset.creator_id)"
+    )
+    op.execute(
+        'DELETE FROM "user" WHERE id NOT IN (SELECT min(id) FROM "user" GROUP BY nickname)'
+    )
+
+    op.execute(
+        "UPDATE tag_association_table SET tag_id = ("
+        "SELECT min(t2.id) FROM tag t1 JOIN tag t2 ON t2.label = t1.label "
+        "WHERE t1.id = tag_association_table.tag_id)"
+    )
+    op.execute("DELETE FROM tag WHERE id NOT IN (SELECT min(id) FROM tag GROUP BY label)")
+
+    op.execute(
+        "UPDATE asset SET download_url = ("
+        "SELECT max(a2.download_url) FROM asset a2 WHERE a2.slug = asset.slug) "
+        "WHERE download_url IS NULL"
+    )
+    for table in ("download", "tag_association_table"):
+        op.execute(
+            f"UPDATE {table} SET asset_id = ("
+            "SELECT min(a2.id) FROM asset a1 JOIN asset a2 ON a2.slug = a1.slug "
+            f"WHERE a1.id = {table}.asset_id)"
+        )
+    op.execute(
+        "DELETE FROM illustration WHERE asset_id NOT IN "
+        "(SELECT min(id) FROM asset GROUP BY slug)"
+    )
+    op.execute("DELETE FROM asset WHERE id NOT IN (SELECT min(id) FROM asset GROUP BY slug)")
+
+    op.execute(
+        "DELETE FROM tag_association_table WHERE asset_id IS NULL OR tag_id IS NULL"
+    )
+    op.execute(
+        "CREATE TABLE tag_association_dedupe AS "
+        "SELECT DISTINCT asset_id, tag_id FROM tag_association_table"
+    )
+    op.execute("DELETE FROM tag_association_table")
+    op.execute(
+        "INSERT INTO tag_association_table (asset_id, tag_id) "
+        "SELECT asset_id, tag_id FROM tag_association_dedupe"
+    )
+    op.execute("DROP TABLE tag_association_dedupe")
+
+
+def upgrade() -> None:
+    _dedupe()
+
+    with op.batch_alter_table("tag_association_table") as batch_op:
+        batch_op.alter_column("asset_id", existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column("tag_id", existing_type=sa.Integer(), nullable=False)
+        batch_op.create_primary_key(
+            "tag_association_table_pkey", ["asset_id", "tag_id"]
+        )
+
+    op.create_index(op.f("ix_asset_slug"), "asset", ["slug"], unique=True)
+    op.create_index(op.f("ix_tag_label"), "tag", ["label"], unique=True)
+    op.create_index(op.f("ix_user_nickname"), "user", ["nickname"], unique=True)
+
+    op.create_index(op.f("ix_asset_creator_id"), "asset", ["creator_id"])
+    op.create_index(op.f("ix_category_parent_id"), "category", ["parent_id"])
+    op.create_index(op.f("ix_download_asset_id"), "download", ["asset_id"])
+    op.create_index(op.f("ix_illustration_asset_id"), "illustration", ["asset_id"])
+    op.create_index(
+        op.f("ix_tag_association_table_tag_id"), "tag_association_table", ["tag_id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_tag_association_table_tag_id"), table_name="tag_association_table"
+    )
+    op.drop_index(op.f("ix_illustration_asset_id"), table_name="illustration")
+    op.drop_index(op.f("ix_download_asset_id"), table_name="download")
+    op.drop_index(op.f("ix_category_parent_id"), table_name="category")
+    op.drop_index(op.f("ix_asset_creator_id"), table_name="asset")
+
+    op.drop_index(op.f("ix_user_nickname"), table_name="user")
+    op.drop_index(op.f("ix_tag_label"), table_name="tag")
+    op.drop_index(op.f("ix_asset_slug"), table_name="asset")
+
+    with op.batch_alter_table("tag_association_table") as batch_op:
+        batch_op.drop_constraint("tag_association_table_pkey", type_="primary")
+        batch_op.alter_column("tag_id", existing_type=sa.Integer(), nullable=True)
+        batch_op.alter_column("asset_id", existing_type=sa.Integer(), nullable=True)
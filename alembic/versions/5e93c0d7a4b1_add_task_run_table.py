@@ -0,0 +1,47 @@
+"""Add task run table
+
+Revision ID: 5e93c0d7a4b1
+Revises: 8b7d41e0c2f6
+Create Date: 2026-10-17 11:20:37.582093
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5e93c0d7a4b1"
+down_revision: Union[str, None] = "8b7d41e0c2f6"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "task_run",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=False),
+        sa.Column("duration", sa.Float(), nullable=True),
+        sa.Column("outcome", sa.String(), nullable=False),
+        sa.Column("error", sa.String(), nullable=True),
+        sa.Column("items", sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_task_run_started_at"), "task_run", ["started_at"], unique=False
+    )
+    op.create_index(
+        "ix_task_run_name_started_at",
+        "task_run",
+        ["name", "started_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_task_run_name_started_at", table_name="task_run")
+    op.drop_index(op.f("ix_task_run_started_at"), table_name="task_run")
+    op.drop_table("task_run")
@@ -0,0 +1,33 @@
+"""Add cults login table
+
+Revision ID: 6d2e8a4c1b90
+Revises: 0f5b2c383b4d
+Create Date: 2026-10-17 08:12:44.201573
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "6d2e8a4c1b90"
+down_revision: Union[str, None] = "0f5b2c383b4d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "cults_login",
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("cookies", sa.JSON(), nullable=False),
+        sa.Column("logged_in_at", sa.DateTime(), nullable=False),
+        sa.Column("checked_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("email"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("cults_login")
@@ -0,0 +1,69 @@
+"""Add asset search index
+
+Revision ID: a1bb2f95d52a
+Revises: af65a1990f8a
+Create Date: 2026-10-17 06:52:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a1bb2f95d52a"
+down_revision: Union[str, None] = "af65a1990f8a"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Must stay identical to the expression compiled by polymer.orms._search
+DOCUMENT = "to_tsvector('english', slug || ' ' || name || ' ' || description || ' ' || details)"
+COLUMNS = "slug, name, description, details"
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute(
+            f"CREATE VIRTUAL TABLE asset_fts USING fts5({COLUMNS}, "
+            "content='asset', content_rowid='id')"
+        )
+        op.execute(
+            "CREATE TRIGGER asset_fts_ai AFTER INSERT ON asset BEGIN "
+            f"INSERT INTO asset_fts(rowid, {COLUMNS}) "
+            "VALUES (new.id, new.slug, new.name, new.description, new.details); END"
+        )
+        op.execute(
+            "CREATE TRIGGER asset_fts_ad AFTER DELETE ON asset BEGIN "
+            f"INSERT INTO asset_fts(asset_fts, rowid, {COLUMNS}) "
+            "VALUES ('delete', old.id, old.slug, old.name, old.description, old.details); END"
+        )
+        op.execute(
+            "CREATE TRIGGER asset_fts_au AFTER UPDATE ON asset BEGIN "
+            f"INSERT INTO asset_fts(asset_fts, rowid, {COLUMNS}) "
+            "VALUES ('delete', old.id, old.slug, old.name, old.description, old.details); "
+            f"INSERT INTO asset_fts(rowid, {COLUMNS}) "
+            "VALUES (new.id, new.slug, new.name, new.description, new.details); END"
+        )
+        op.execute("INSERT INTO asset_fts(asset_fts) VALUES ('rebuild')")
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(f"CREATE INDEX ix_asset_search ON asset USING gin ({DOCUMENT})")
+    op.execute(
+        "CREATE INDEX ix_asset_slug_trgm ON asset USING gin (slug gin_trgm_ops)"
+    )
+    op.execute(
+        'CREATE INDEX ix_user_nickname_trgm ON "user" '
+        "USING gin (nickname gin_trgm_ops)"
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        for trigger in ("asset_fts_ai", "asset_fts_ad", "asset_fts_au"):
+            op.execute(f"DROP TRIGGER {trigger}")
+        op.execute("DROP TABLE asset_fts")
+        return
+
+    op.drop_index("ix_user_nickname_trgm", table_name="user")
+    op.drop_index("ix_asset_slug_trgm", table_name="asset")
+    op.drop_index("ix_asset_search", table_name="asset")
@@ -0,0 +1,28 @@
+"""Add download size and sha256
+
+Revision ID: c3f1a9d27e55
+Revises: 6d2e8a4c1b90
+Create Date: 2026-10-17 08:40:19.774102
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c3f1a9d27e55"
+down_revision: Union[str, None] = "6d2e8a4c1b90"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("download", sa.Column("size", sa.BigInteger(), nullable=True))
+    op.add_column("download", sa.Column("sha256", sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("download", "sha256")
+    op.drop_column("download", "size")
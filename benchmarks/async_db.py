@@ -0,0 +1,129 @@
+# Latency of cheap requests while slow searches are in flight, with the API's
+# queries run on the async engine or inline on the event loop as they used to be.
+#
+#   poetry run python benchmarks/async_db.py [--assets 40000]
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from typing import Any
+
+# Settings are read at import time, so these have to be in place first
+ROOT = tempfile.mkdtemp(prefix="polymer-bench-")
+for name, value in {
+    "DB_URL": f"sqlite:///{ROOT}/polymer.db",
+    "DOWNLOAD_DIR": f"{ROOT}/downloads",
+    "PASSWORD": "password",
+    "APIKEY": "apikey",
+}.items():
+    os.environ.setdefault(name, value)
+
+import httpx  # noqa: E402
+from sqlalchemy import func, insert, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from polymer.api import db_proxy  # noqa: E402
+from polymer.app import app  # noqa: E402
+from polymer.connectors.db import AsyncDbProxy  # noqa: E402
+from polymer.orms import Asset, Base, Tag, User, engine  # noqa: E402
+
+
+class BlockingSession:
+    # Looks like an AsyncSession but runs every query on the event loop
+    def __init__(self, session: Session) -> None:
+        self.session = session
+        self.bind = session.bind
+
+    async def execute(self, *args: Any, **kwargs: Any) -> Any:
+        return self.session.execute(*args, **kwargs)
+
+    def add(self, orm: Any) -> None:
+        self.session.add(orm)
+
+    async def delete(self, orm: Any) -> None:
+        self.session.delete(orm)
+
+    async def commit(self) -> None:
+        self.session.commit()
+
+
+async def blocking_db_proxy():
+    with Session(engine, expire_on_commit=False) as session:
+        yield AsyncDbProxy(BlockingSession(session))  # type: ignore[arg-type]
+
+
+def seed(assets: int) -> None:
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        if session.scalar(select(func.count(Asset.id))) >= assets:
+            return
+
+        creator = User(nickname="maker")
+        session.add_all([creator, *(Tag(label=f"tag-{i}") for i in range(50))])
+        session.flush()
+        session.execute(
+            insert(Asset),
+            [
+                {
+                    "name": f"Model {i}",
+                    "slug": f"model-{i}",
+                    "details": "",
+                    "description": os.urandom(1000).hex(),
+                    "cents": 100,
+                    "yanked": False,
+                    "creator_id": creator.id,
+                }
+                for i in range(assets)
+            ],
+        )
+        session.commit()
+
+
+async def timed(client: httpx.AsyncClient, url: str, delay: float = 0) -> float:
+    await asyncio.sleep(delay)
+    start = time.perf_counter()
+    res = await client.get(url)
+    res.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def run(searches: int, requests: int) -> None:
+    transport = httpx.ASGITransport(app=app)  # type: ignore[arg-type]
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+        await c.get("/api/tags")
+        for mode in ("blocking", "async"):
+            if mode == "blocking":
+                app.dependency_overrides[db_proxy] = blocking_db_proxy
+            else:
+                app.dependency_overrides.pop(db_proxy, None)
+
+            # A different term each time, so no count comes from the cache
+            res = await asyncio.gather(
+                *(
+                    timed(c, f"/api/assets?q=zz{mode}{i}&_start=0&_end=10")
+                    for i in range(searches)
+                ),
+                *(timed(c, "/api/tags", 0.01) for _ in range(requests)),
+            )
+            slow, fast = res[:searches], res[searches:]
+            print(
+                f"{mode:>8}: search {statistics.mean(slow):.3f}s, /api/tags mean "
+                f"{statistics.mean(fast):.3f}s max {max(fast):.3f}s"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--assets", type=int, default=40_000)
+    parser.add_argument("--searches", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=8)
+    args = parser.parse_args()
+
+    seed(args.assets)
+    asyncio.run(run(args.searches, args.requests))
+
+
+if __name__ == "__main__":
+    main()
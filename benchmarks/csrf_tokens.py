@@ -0,0 +1,72 @@
+# CPU time to read the CSRF and authenticity tokens from a large page, parsing
+# the whole DOM as free orders used to against the streaming extractor.
+#
+#   poetry run python benchmarks/csrf_tokens.py [--cards 4000]
+import argparse
+import asyncio
+import os
+import time
+from collections.abc import Callable
+
+# Settings are read at import time, so these have to be in place first
+os.environ.setdefault("DB_URL", "sqlite://")
+os.environ.setdefault("PASSWORD", "password")
+os.environ.setdefault("APIKEY", "apikey")
+
+import httpx  # noqa: E402
+from bs4 import BeautifulSoup  # noqa: E402
+
+from polymer.connectors.cults_client import _extract_tokens  # noqa: E402
+
+HEAD = (
+    '<html><head><meta charset="utf-8">'
+    '<meta name="csrf-token" content="csrf+/=&amp;1"></head><body><form>'
+    '<input type="hidden" name="authenticity_token" value="auth&amp;1"></form>'
+)
+
+
+def page(cards: int) -> bytes:
+    body = "".join(
+        f'<div class="card"><a href="/c/{i}"><img src="/i/{i}.jpg" alt="thing {i}">'
+        f"</a><p>desc {i}</p></div>"
+        for i in range(cards)
+    )
+    return (HEAD + body + "</body></html>").encode()
+
+
+def parsed(content: bytes) -> tuple[str, str]:
+    html = BeautifulSoup(content.decode(), "html.parser")
+    meta = html.find("meta", {"name": "csrf-token"})
+    field = html.find("input", {"name": "authenticity_token"})
+    return meta["content"], field["value"]  # type: ignore
+
+
+def streamed(content: bytes) -> tuple[str, str]:
+    res = httpx.Response(
+        200, content=content, headers={"Content-Type": "text/html; charset=utf-8"}
+    )
+    return asyncio.run(_extract_tokens(res))
+
+
+def cpu(extract: Callable[[bytes], tuple[str, str]], content: bytes, n: int) -> float:
+    start = time.process_time()
+    for _ in range(n):
+        extract(content)
+    return (time.process_time() - start) / n
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cards", type=int, default=4000)
+    parser.add_argument("-n", type=int, default=30)
+    args = parser.parse_args()
+
+    content = page(args.cards)
+    assert parsed(content) == streamed(content) == ("csrf+/=&1", "auth&1")
+    print(f"{len(content) // 1024}KB page, CPU per extraction:")
+    for extract in (parsed, streamed):
+        print(f"{extract.__name__:>9}: {cpu(extract, content, args.n) * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
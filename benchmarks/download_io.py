@@ -0,0 +1,135 @@
+# Event loop lag while concurrent downloads write to a slow disk, writing each
+# chunk on the loop as downloads used to against the threaded block writer.
+#
+#   poetry run python benchmarks/download_io.py [--downloads 3 --size 20]
+import argparse
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from pathlib import Path
+from typing import Any, BinaryIO
+
+# Settings are read at import time, so these have to be in place first
+ROOT = tempfile.mkdtemp(prefix="polymer-bench-")
+os.environ.setdefault("DB_URL", "sqlite://")
+os.environ.setdefault("DOWNLOAD_DIR", f"{ROOT}/downloads")
+os.environ.setdefault("PASSWORD", "password")
+os.environ.setdefault("APIKEY", "apikey")
+
+import httpx  # noqa: E402
+
+from polymer.config import settings  # noqa: E402
+from polymer.connectors import downloads  # noqa: E402
+from polymer.connectors.cults_client import CultsClient  # noqa: E402
+
+CHUNK_SIZE = 64 * 1024
+
+
+class SlowDisk:
+    # Every write call pays a seek plus transfer time, like a busy spinning disk
+    def __init__(self, file: BinaryIO, seek: float, bandwidth: float) -> None:
+        self.file = file
+        self.seek = seek
+        self.bandwidth = bandwidth
+
+    def write(self, data: bytes) -> int:
+        time.sleep(self.seek + len(data) / self.bandwidth)
+        return self.file.write(data)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.file, name)
+
+
+def slow_writer(seek: float, bandwidth: float) -> type[downloads.AsyncFileWriter]:
+    class SlowWriter(downloads.AsyncFileWriter):
+        def __init__(self, file: BinaryIO, hasher: Any, block_size: int) -> None:
+            disk = SlowDisk(file, seek, bandwidth)
+            super().__init__(disk, hasher, block_size)  # type: ignore[arg-type]
+
+    return SlowWriter
+
+
+def transport(body: bytes) -> httpx.MockTransport:
+    class Body(httpx.AsyncByteStream):
+        async def __aiter__(self) -> AsyncIterator[bytes]:
+            for start in range(0, len(body), CHUNK_SIZE):
+                yield body[start : start + CHUNK_SIZE]
+                await asyncio.sleep(0)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        headers = {
+            "Content-Disposition": 'attachment; filename="benchy.zip"',
+            "Content-Length": str(len(body)),
+        }
+        return httpx.Response(200, headers=headers, stream=Body())
+
+    return httpx.MockTransport(handler)
+
+
+async def inline(client: CultsClient, slug: str, disk: tuple[float, float]) -> None:
+    dest = Path(settings.download_dir, "inline", slug)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    hasher = hashlib.sha256()
+    async with client.client.stream("GET", "https://files.cults3d.com/d") as res:
+        with dest.open("wb") as f:
+            slow = SlowDisk(f, *disk)
+            async for chunk in res.aiter_bytes():
+                slow.write(chunk)
+                hasher.update(chunk)
+
+
+async def lag(samples: list[float]) -> None:
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        samples.append(time.perf_counter() - start - 0.001)
+
+
+async def measure(
+    name: str, count: int, download: Callable[[str], Awaitable[Any]]
+) -> None:
+    samples: list[float] = []
+    ticker = asyncio.create_task(lag(samples))
+    start = time.perf_counter()
+    await asyncio.gather(*(download(f"{name}-{i}") for i in range(count)))
+    elapsed = time.perf_counter() - start
+    ticker.cancel()
+
+    samples.sort()
+    p50, p99 = samples[len(samples) // 2], samples[int(len(samples) * 0.99)]
+    print(
+        f"{name:>8}: {elapsed:.2f}s total, loop lag p50 {p50 * 1000:.1f}ms "
+        f"p99 {p99 * 1000:.1f}ms max {samples[-1] * 1000:.1f}ms"
+    )
+
+
+async def run(count: int, size: int, disk: tuple[float, float]) -> None:
+    body = os.urandom(size)
+    downloads.AsyncFileWriter = slow_writer(*disk)  # type: ignore[misc]
+    async with httpx.AsyncClient(transport=transport(body)) as http:
+        client = CultsClient(http)
+        await measure("inline", count, lambda slug: inline(client, slug, disk))
+        await measure(
+            "threaded",
+            count,
+            lambda slug: client._download_order(slug, "https://files.cults3d.com/d"),
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--downloads", type=int, default=3)
+    parser.add_argument("--size", type=int, default=20, help="MB per download")
+    parser.add_argument("--seek", type=float, default=0.005, help="seconds per write")
+    parser.add_argument("--bandwidth", type=float, default=200, help="MB/s")
+    args = parser.parse_args()
+
+    disk = (args.seek, args.bandwidth * 1e6)
+    asyncio.run(run(args.downloads, args.size * 1_000_000, disk))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,57 @@
+import asyncio
 import datetime
 from dataclasses import dataclass
 from logging import getLogger
-from pathlib import Path
-from typing import Annotated, Any, Generic, Iterable, Self, Type, TypeVar
+from typing import Annotated, Any, Generic, Iterable, Literal, Self, Type, TypeVar
 from uuid import uuid4
 
 import httpx
 from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import RedirectResponse
 from pydantic import BaseModel
 from sqlalchemy import Select
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from polymer.connectors.db import DbProxy
+from polymer.connectors.db import AsyncDbProxy, encode_cursor
 from polymer.orms.mmf import Mmf
 
 from .config import Settings, settings
-from .lifespan import manager
+from .connectors.concurrency import download_concurrency
+from .connectors.identity import caches
+from .connectors.rate_limit import limiters
+from .lifespan import election, manager
 from .models import (
+    ActorModel,
     AssetModel,
+    BundleEntryModel,
+    CacheModel,
     CategoryCreate,
     CategoryModel,
     CultsModel,
     DownloadModel,
+    JobModel,
+    LeaderModel,
+    LimitModel,
     MmfModel,
+    SyncModel,
     TagModel,
     TaskModel,
     UserModel,
 )
-from .orms import Asset, Category, Download, Tag, User, engine
+from .orms import (
+    Asset,
+    Category,
+    CultsLogin,
+    Download,
+    Job,
+    JobKind,
+    SyncState,
+    Tag,
+    TaskOutcome,
+    User,
+    async_engine,
+)
+from .serving import on_disk, serve_bundle, serve_download
 from .config import settings
 
 logger = getLogger(__name__)
@@ -40,29 +63,39 @@ O = TypeVar("O")
 M = TypeVar("M", bound=BaseModel)
 
 
-def db_proxy():
-    with Session(engine) as session:
-        yield DbProxy(session)
+async def db_proxy():
+    # Routes validate ORMs after commit, so keep loaded attributes around
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield AsyncDbProxy(session)
 
 
 @dataclass
 class Pagination:
     offset: int
     limit: int
+    cursor: str | None = None
 
     @classmethod
     def get(
         cls,
-        _start: Annotated[int | None, Query()] = None,
-        _end: Annotated[int | None, Query()] = None,
+        _start: Annotated[int | None, Query(ge=0)] = None,
+        _end: Annotated[int | None, Query(ge=0)] = None,
+        _cursor: Annotated[str | None, Query()] = None,
+        _limit: Annotated[int, Query(gt=0)] = 100,
     ) -> Self | None:
+        # An empty ``_cursor`` opts into cursor mode starting from the first page
+        if _cursor is not None:
+            return cls(0, _limit, _cursor)
+
         if _start is not None and _end is not None:
-            return cls(_start, _end)
+            if _end < _start:
+                raise HTTPException(422, "_end must not be before _start")
+            return cls(_start, _end - _start)
 
         return None
 
 
-DbProxyDep = Annotated[DbProxy, Depends(db_proxy)]
+DbProxyDep = Annotated[AsyncDbProxy, Depends(db_proxy)]
 PaginationDep = Annotated[Pagination | None, Depends(Pagination.get)]
 
 
@@ -73,23 +106,33 @@ class Controller(Generic[M]):
         response: Response,
         db: DbProxyDep,
         pagination: PaginationDep,
+        _count: Annotated[Literal["exact", "estimate"], Query()] = "exact",
     ) -> None:
         self.request = request
         self.response = response
         self.db = db
         self.pagination = pagination
+        self.estimate = _count == "estimate"
+
+    async def list(self, Model: Type[M], stmt: Iterable[Any]) -> Iterable[M]:
+        total = await self.db.total(stmt, self.estimate)
+        orms = await self.db.all_or_paginated(stmt, self.pagination)
 
-    def list(self, Model: Type[M], stmt: Iterable[Any]) -> Iterable[M]:
-        count = self.db.count(stmt)
-        orms = self.db.all_or_paginated(stmt, self.pagination)
+        self.response.headers.append("X-Total-Count", str(total.count))
+        self.response.headers.append("X-Total-Count-Strategy", total.strategy)
+        if (
+            self.pagination
+            and self.pagination.cursor is not None
+            and len(orms) == self.pagination.limit
+        ):
+            self.response.headers.append("X-Next-Cursor", encode_cursor(stmt, orms[-1]))
 
-        self.response.headers.append("X-Total-Count", str(count))
         return [Model.model_validate(o, from_attributes=True) for o in orms]
 
-    def create(self, Model: Type[M], endpoint: str, orm: Any) -> M:
+    async def create(self, Model: Type[M], endpoint: str, orm: Any) -> M:
         # orm = Category(label=body.label, parent_id=body.parent_id)
         self.db.add(orm)
-        self.db.commit()
+        await self.db.commit()
 
         self.response.headers.append(
             "Location", str(self.request.url_for(endpoint, id=orm.id))
@@ -97,15 +140,15 @@ class Controller(Generic[M]):
 
         return Model.model_validate(orm, from_attributes=True)
 
-    def one(self, Model: Type[M], stmt: Iterable[Any]) -> M:
-        orm = self.db.one(stmt)
+    async def one(self, Model: Type[M], stmt: Iterable[Any]) -> M:
+        orm = await self.db.one(stmt)
         return Model.model_validate(orm, from_attributes=True)
 
-    def delete(self, Model: Type[M], stmt: Iterable[Any]) -> M:
-        orm = self.db.one(stmt)
+    async def delete(self, Model: Type[M], stmt: Iterable[Any]) -> M:
+        orm = await self.db.one(stmt)
         resp = Model.model_validate(orm, from_attributes=True)
-        self.db.delete(orm)
-        self.db.commit()
+        await self.db.delete(orm)
+        await self.db.commit()
         return resp
 
 
@@ -114,10 +157,13 @@ MmfController = Annotated[Controller[Mmf], Depends()]
 
 AllAssetsDep = Annotated[Select[tuple[Asset]], Depends(Asset.select_all)]
 OneAssetDep = Annotated[Select[tuple[Asset]], Depends(Asset.select_one)]
+BundleDep = Annotated[Select[tuple[Download]], Depends(Download.select_bundle)]
 
 AllDownloadsDep = Annotated[Select[tuple[Download]], Depends(Download.select_all)]
 OneDownloadDep = Annotated[Select[tuple[Download]], Depends(Download.select_one)]
 
+OneJobDep = Annotated[Select[tuple[Job]], Depends(Job.select_one)]
+
 AllTagsDep = Annotated[Select[tuple[Tag]], Depends(Tag.select_all)]
 OneTagDep = Annotated[Select[tuple[Tag]], Depends(Tag.select_one)]
 
@@ -129,65 +175,100 @@ OneCatagoryDep = Annotated[Select[tuple[Category]], Depends(Category.select_one)
 
 OneMmfDep = Annotated[Select[tuple[Mmf]], Depends(Mmf.select_one)]
 
+async def leader_only() -> None:
+    # Scheduled work, and the in-memory state it keeps, only exists on the leader
+    if not election.is_leader:
+        holder = await asyncio.to_thread(election.holder) or "(none elected)"
+        raise HTTPException(409, f"Served by the leader {holder}, not {election.id}")
+
+
+LeaderOnly = Depends(leader_only)
+
+
 @router.get("/assets")
 async def asset_list(controller: ControllerDep, stmt: AllAssetsDep) -> list[AssetModel]:
-    return controller.list(AssetModel, stmt)
+    return await controller.list(AssetModel, stmt)
+
+
+@router.get("/assets/bundle")
+async def asset_bundle(db: DbProxyDep, stmt: BundleDep) -> Response:
+    downloads, missing = await asyncio.to_thread(on_disk, await db.all(stmt))
+    if missing:
+        logger.warning(f"Downloads {missing} are missing from disk, leaving them out")
+    if not downloads:
+        raise HTTPException(404, "No downloaded assets match")
+
+    return serve_bundle(downloads, missing)
+
+
+@router.get("/assets/bundle/manifest")
+async def asset_bundle_manifest(
+    db: DbProxyDep, stmt: BundleDep
+) -> list[BundleEntryModel]:
+    # Same entries as the bundle itself, which leaves out files missing from disk
+    downloads, _ = await asyncio.to_thread(on_disk, await db.all(stmt))
+    return [
+        BundleEntryModel(
+            id=d.id,
+            asset_id=d.asset_id,
+            path=f"{d.asset.slug}/{d.filename}",
+            size=d.size,
+            sha256=d.sha256,
+        )
+        for d in downloads
+    ]
 
 
 @router.get("/assets/{id}")
 async def asset(controller: ControllerDep, stmt: OneAssetDep) -> AssetModel:
-    return controller.one(AssetModel, stmt)
+    return await controller.one(AssetModel, stmt)
 
 
 @router.get("/assets/{id}/download")
-async def asset_download(db: DbProxyDep, stmt: OneAssetDep) -> Response:
-    orm = db.one(stmt)
+async def asset_download(
+    request: Request, db: DbProxyDep, stmt: OneAssetDep
+) -> Response:
+    orm = await db.one(stmt)
 
-    if not orm.downloaded:
+    if not orm.downloads:
         raise HTTPException(404)
 
-    path = Path(settings.download_dir, orm.slug)
-    filepath = next(path.iterdir())
-
-    return FileResponse(filepath, filename=filepath.name)
+    download = max(orm.downloads, key=lambda d: d.id)
+    return serve_download(request, download)
 
 
 @router.get("/downloads")
 async def downloads_list(
     controller: ControllerDep, stmt: AllDownloadsDep
 ) -> list[DownloadModel]:
-    return controller.list(DownloadModel, stmt)
+    return await controller.list(DownloadModel, stmt)
 
 
 @router.get("/downloads/{id}")
 async def get_download(
     controller: ControllerDep, stmt: OneDownloadDep
 ) -> DownloadModel:
-    return controller.one(DownloadModel, stmt)
+    return await controller.one(DownloadModel, stmt)
 
 @router.get("/downloads/{id}/download")
 async def get_download(
-    controller: ControllerDep, stmt: OneDownloadDep
-) -> FileResponse:
-    orm = controller.db.one(stmt)
-
-    path = Path(settings.download_dir, orm.asset.slug)
-    filepath = next(path.iterdir())
-
-    return FileResponse(filepath, filename=filepath.name)
+    request: Request, controller: ControllerDep, stmt: OneDownloadDep
+) -> Response:
+    orm = await controller.db.one(stmt)
+    return serve_download(request, orm)
 
 
 @router.get("/tags")
 async def tag_list(controller: ControllerDep, stmt: AllTagsDep) -> list[TagModel]:
-    return controller.list(TagModel, stmt)
+    return await controller.list(TagModel, stmt)
 
 
 @router.get("/tags/{id}")
 async def tag(controller: ControllerDep, stmt: OneTagDep) -> TagModel:
-    return controller.one(TagModel, stmt)
+    return await controller.one(TagModel, stmt)
 
 
-@router.get("/tasks")
+@router.get("/tasks", dependencies=[LeaderOnly])
 async def task_list(
     response: Response,
     db: DbProxyDep,
@@ -202,10 +283,17 @@ async def task_list(
             name=s.callable.__qualname__,
             cron=s.cron,
             startup=s.startup,
+            events=list(s.events),
             last_run_at=datetime.datetime.fromtimestamp(s.last_run_at)
             if s.last_duration
             else None,
             last_duration=s.last_duration if s.last_duration else None,
+            runs=len(s.stats.window),
+            p50=s.stats.percentile(0.5),
+            p95=s.stats.percentile(0.95),
+            p99=s.stats.percentile(0.99),
+            failure_rate=s.stats.failure_rate,
+            skipped=s.stats.outcomes[TaskOutcome.SKIPPED],
         )
         for i, s in enumerate(manager.specs)
     ]
@@ -213,50 +301,152 @@ async def task_list(
     return tasks
 
 
-@router.post("/tasks/{id}/run-now")
+@router.post("/tasks/{id}/run-now", dependencies=[LeaderOnly])
 async def task_run(id: int) -> None:
     spec = manager.specs[id]
     manager._start_task(spec)
     return
 
 
+@router.get("/leader")
+async def leader_status() -> LeaderModel:
+    return LeaderModel(
+        id=election.id,
+        leader=election.is_leader,
+        since=election.since,
+        backend=election.backend,
+    )
+
+
+@router.get("/caches", dependencies=[LeaderOnly])
+async def cache_list(response: Response) -> list[CacheModel]:
+    models = [
+        CacheModel(
+            name=c.name,
+            size=len(c.entries),
+            maxsize=c.maxsize,
+            hits=c.hits,
+            misses=c.misses,
+        )
+        for c in caches
+    ]
+    response.headers.append("X-Total-Count", str(len(models)))
+    return models
+
+
+@router.get("/limits", dependencies=[LeaderOnly])
+async def limit_list(response: Response) -> list[LimitModel]:
+    models = [
+        LimitModel(
+            host=host,
+            rate=limiter.rate,
+            min_rate=limiter.min_rate,
+            max_rate=limiter.max_rate,
+            tokens=limiter.available(),
+            requests=limiter.requests,
+            retries=limiter.retries,
+            throttled=limiter.throttled,
+            errors=limiter.errors,
+            latency=limiter.latency,
+            paused_for=limiter.paused_for(),
+        )
+        for host, limiter in limiters.items()
+    ]
+    response.headers.append("X-Total-Count", str(len(models)))
+    return models
+
+
+@router.get("/actor", dependencies=[LeaderOnly])
+async def actor_status(db: DbProxyDep) -> ActorModel:
+    # Enqueue to finish, over the most recent downloads
+    jobs = await db.all(Job.select_finished(JobKind.DOWNLOAD, 100))
+    latencies = sorted((j.finished_at - j.created_at).total_seconds() for j in jobs)
+
+    def percentile(p: float) -> float | None:
+        if not latencies:
+            return None
+        return latencies[min(int(p * len(latencies)), len(latencies) - 1)]
+
+    c = download_concurrency
+    return ActorModel(
+        concurrency=c.concurrency,
+        min_concurrency=c.min_limit,
+        max_concurrency=c.max_limit,
+        in_flight=c.in_flight,
+        bytes_per_second=c.throughput,
+        bandwidth_cap=c.cap,
+        latency=c.latency,
+        bytes=c.bytes,
+        completed=c.completed,
+        errors=c.errors,
+        queue_latency_p50=percentile(0.5),
+        queue_latency_p95=percentile(0.95),
+    )
+
+
+@router.get("/jobs")
+async def job_list(controller: ControllerDep) -> list[JobModel]:
+    return await controller.list(JobModel, Job.select_all())
+
+
+@router.get("/jobs/{id}")
+async def job(controller: ControllerDep, stmt: OneJobDep) -> JobModel:
+    return await controller.one(JobModel, stmt)
+
+
+@router.post("/jobs/{id}/retry")
+async def job_retry(db: DbProxyDep, stmt: OneJobDep) -> JobModel:
+    job = await db.one(stmt)
+    if job.leased_until is not None and job.leased_until > datetime.datetime.utcnow():
+        raise HTTPException(409, f"Job {job.id} is running on {job.leased_by}")
+
+    job.reset()
+    await db.commit()
+    return JobModel.model_validate(job, from_attributes=True)
+
+
+@router.get("/syncs")
+async def syncs_list(controller: ControllerDep) -> list[SyncModel]:
+    return await controller.list(SyncModel, SyncState.select_all())
+
+
 @router.get("/users")
 async def users_list(controller: ControllerDep, stmt: AllUsersDep) -> list[UserModel]:
-    return controller.list(UserModel, stmt)
+    return await controller.list(UserModel, stmt)
 
 
 @router.get("/users/{id}")
 async def asset(controller: ControllerDep, stmt: OneUserDep) -> UserModel:
-    return controller.one(UserModel, stmt)
+    return await controller.one(UserModel, stmt)
 
 
 @router.get("/categories")
 async def catagory_list(
     controller: ControllerDep, stmt: AllCatagoriesDep
 ) -> list[CategoryModel]:
-    return controller.list(CategoryModel, stmt)
+    return await controller.list(CategoryModel, stmt)
 
 
 @router.post("/categories", status_code=201)
 async def catagory_create(
     controller: ControllerDep, body: CategoryCreate
 ) -> CategoryModel:
-    orm = Category(label=body.label, parent_id=body.parent_id)
-    return controller.create(CategoryModel, "get_category", orm)
+    orm = Category(label=body.label, parent_id=body.parent_id, children=[])
+    return await controller.create(CategoryModel, "get_category", orm)
 
 
 @router.get("/categories/{id}")
 async def get_category(
     controller: ControllerDep, stmt: OneCatagoryDep
 ) -> CategoryModel:
-    return controller.one(CategoryModel, stmt)
+    return await controller.one(CategoryModel, stmt)
 
 
 @router.delete("/categories/{id}")
 async def delete_category(
     controller: ControllerDep, stmt: OneCatagoryDep
 ) -> CategoryModel:
-    return controller.delete(CategoryModel, stmt)
+    return await controller.delete(CategoryModel, stmt)
 
 
 @router.get("/mmf/login")
@@ -300,7 +490,7 @@ async def mmf_callback(request: Request, code: str, state: str, controller: Cont
     )
     data2 = res2.json()
 
-    return controller.create(MmfModel, "", Mmf(
+    return await controller.create(MmfModel, "", Mmf(
         user_id=data1['user_id'],
         access_token=data1['access_token'],
         refresh_token=data1['refresh_token'],
@@ -322,8 +512,13 @@ async def mmf_refresh(controller: ControllerDep) -> dict:
 
 @router.get("/mmf/status")
 async def mmf_refresh(controller: ControllerDep, stmt: OneMmfDep) -> MmfModel:
-    return controller.one(MmfModel, stmt)
+    return await controller.one(MmfModel, stmt)
 
 @router.get("/cults/status")
-async def mmf_refresh() -> CultsModel:
-    return CultsModel(email=settings.email)
\ No newline at end of file
+async def mmf_refresh(controller: ControllerDep) -> CultsModel:
+    login = await controller.db.one_or_none(
+        CultsLogin.select_one().where(CultsLogin.email == settings.email)
+    )
+    if login is None:
+        return CultsModel(email=settings.email)
+    return CultsModel.model_validate(login, from_attributes=True)
\ No newline at end of file
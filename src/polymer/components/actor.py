@@ -1,11 +1,13 @@
+import asyncio
 from logging import getLogger
 
-import aiometer
-from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+from ..config import settings
+from ..connectors.concurrency import download_concurrency
 from ..connectors.cults_client import CultsClient
-from ..orms import Asset, Download
+from ..orms import Asset, Download, Job, JobKind
+from .job_queue import JobQueue
 
 logger = getLogger(__name__)
 
@@ -15,53 +17,107 @@ class Actor:
         self,
         client: CultsClient,
         session: Session,
+        queue: JobQueue,
     ) -> None:
         self.client = client
         self.session = session
+        self.queue = queue
+        self.wakeup = asyncio.Event()
 
-    async def order_liked_free(self) -> None:
-        await self.client.login()
-        liked = (
-            self.session.execute(select(Asset).filter_by(free=True, downloaded=False))
-            .scalars()
-            .all()
+    async def enqueue(self) -> int:
+        # Orders come first, they are what makes an asset downloadable
+        enqueued = self.queue.enqueue(
+            JobKind.FREE_ORDER,
+            Asset.free,
+            Asset.downloaded == False,
+            Asset.download_url.is_(None),
+            priority=1,
         )
+        enqueued += self.queue.enqueue(
+            JobKind.DOWNLOAD,
+            Asset.download_url.is_not(None),
+            Asset.downloaded == False,
+        )
+        # Also wakes workers for jobs the ingester re-armed rather than inserted
+        self.wakeup.set()
+        self.wakeup.clear()
+        return enqueued
 
-        async with aiometer.amap(
-            lambda creation: self.client._free_order(creation.slug),
-            liked,
-            max_at_once=1,  # Limit maximum number of concurrently running tasks.
-            max_per_second=0.5,  # Limit request rate to not overload the server.
-        ):
-            pass
+    async def work(self, n: int) -> None:
+        worker = f"{self.queue.name}/{n}"
+        while True:
+            # Downloads wait for the concurrency controller, orders never do
+            kinds = [JobKind.FREE_ORDER]
+            if download_concurrency.available():
+                kinds.append(JobKind.DOWNLOAD)
 
-    async def download_orders(self) -> None:
-        downloadable = (
-            self.session.execute(
-                select(Asset).where(
-                    Asset.download_url.is_not(None),
-                    Asset.downloaded == False,
-                )
-            )
-            .scalars()
-            .all()
-        )
+            try:
+                job = self.queue.lease(worker, kinds)
+            except Exception:
+                # Leaves the session usable again after a failed transaction
+                logger.exception(f"{worker} could not lease a job, retrying")
+                self.session.rollback()
+                await asyncio.sleep(settings.job_poll_interval)
+                continue
 
-        await self.client.login()
+            if job is None:
+                try:
+                    await asyncio.wait_for(
+                        self.wakeup.wait(), settings.job_poll_interval
+                    )
+                except TimeoutError:
+                    pass
+                continue
 
-        async def _download(creation: Asset) -> Asset:
-            filename = await self.client._download_order(
-                creation.slug, creation.download_url
+            try:
+                await self._run(job, worker)
+            except Exception:
+                # The lease lapses, so another worker picks the job up again
+                logger.exception(f"{worker} could not record {job.kind} job {job.id}")
+                self.session.rollback()
+                await asyncio.sleep(settings.job_poll_interval)
+
+    async def _run(self, job: Job, worker: str) -> None:
+        keepalive = asyncio.create_task(self._keepalive(job, worker))
+        try:
+            await self._perform(job)
+        except Exception as e:
+            logger.exception(f"{job.kind} job {job.id} failed")
+            self.queue.fail(job, repr(e))
+        else:
+            self.queue.complete(job)
+            latency = (job.finished_at - job.created_at).total_seconds()
+            logger.info(
+                f"Finished {job.kind} job {job.id} {latency:.1f}s after enqueue"
             )
-            creation.downloads.append(Download(filename=filename))
+        finally:
+            keepalive.cancel()
+
+    async def _keepalive(self, job: Job, worker: str) -> None:
+        while True:
+            await asyncio.sleep(settings.job_lease / 3)
+            if not self.queue.extend(job, worker):
+                logger.warning(f"Lost the lease on {job.kind} job {job.id}")
+                return
 
-            self.session.commit()
-            return creation
+    async def _perform(self, job: Job) -> None:
+        asset = self.session.get(Asset, job.asset_id)
+        if asset.downloaded:
+            return
 
-        async with aiometer.amap(
-            _download,
-            downloadable,
-            max_at_once=3,  # Limit maximum number of concurrently running tasks.
-            max_per_second=0.5,  # Limit request rate to not overload the server.
-        ) as results:
-            pass
+        await self.client.ensure_session(self.session)
+        match job.kind:
+            case JobKind.FREE_ORDER:
+                await self.client._free_order(asset.slug)
+            case JobKind.DOWNLOAD:
+                async with download_concurrency.slot():
+                    result = await self.client._download_order(
+                        asset.slug, asset.download_url
+                    )
+                asset.downloads.append(
+                    Download(
+                        filename=result.filename,
+                        size=result.size,
+                        sha256=result.sha256,
+                    )
+                )
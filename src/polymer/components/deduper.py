@@ -0,0 +1,53 @@
+import asyncio
+from logging import getLogger
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from ..connectors.blobs import Adopted, BlobStore
+from ..orms import Asset, Download
+
+logger = getLogger(__name__)
+
+
+class Deduper:
+    def __init__(self, session: Session, store: BlobStore) -> None:
+        self.session = session
+        self.store = store
+
+    def _adopt_all(self) -> list[Adopted]:
+        adopted = []
+        for path in self.store.unadopted():
+            try:
+                adopted.append(self.store.adopt(path))
+            except OSError:
+                logger.exception(f"Could not move {path} into the blob store")
+        return adopted
+
+    async def run(self) -> int:
+        adopted = await asyncio.to_thread(self._adopt_all)
+        if not adopted:
+            return 0
+
+        rows = self.session.execute(
+            select(Asset.slug, Download.filename, Download.id)
+            .join(Download.asset)
+            .where(Download.sha256.is_(None))
+        )
+        ids = {(slug, filename): id for slug, filename, id in rows.tuples()}
+
+        values = [
+            {"id": ids[key], "sha256": a.sha256, "size": a.size}
+            for a in adopted
+            if (key := (a.path.parent.name, a.path.name)) in ids
+        ]
+        if values:
+            self.session.execute(update(Download), values)
+        self.session.commit()
+
+        deduped = [a for a in adopted if a.deduped]
+        logger.info(
+            f"Moved {len(adopted)} files into the blob store, {len(deduped)} were "
+            f"duplicates freeing {sum(a.size for a in deduped)} bytes"
+        )
+        return len(adopted)
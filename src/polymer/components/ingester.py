@@ -1,92 +1,346 @@
 #!/usr/bin/env python
 
+import asyncio
+import datetime
+import time
 from asyncio import Queue
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
 from logging import getLogger
-from typing import NoReturn
+from typing import Any, NoReturn
 
-from sqlalchemy import select
+from sqlalchemy import Insert, Table, delete, or_, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
 
+from ..config import settings
 from ..connectors.cults_models import AssetFromCults, OrderFromCults
-from ..orms import Asset, Illustration, Tag, User
+from ..connectors.identity import IdentityCache, tag_ids, user_ids
+from ..orms import Asset, Illustration, Job, JobKind
+from ..orms._base import tag_association_table
 
 logger = getLogger(__name__)
 
+DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+# Emitted after the batch that caused them commits
+NEW_FREE_ASSET = "new_free_asset"
+DOWNLOAD_URL_SET = "download_url_set"
+
+
+@dataclass
+class IngestCounts:
+    new: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    new_free: int = 0
+    download_urls: int = 0
+
 
 class Ingester:
     def __init__(
-        self, session: Session, queue: Queue[AssetFromCults | OrderFromCults]
+        self,
+        session: Session,
+        queue: Queue[AssetFromCults | OrderFromCults],
+        batch_size: int = settings.ingest_batch_size,
+        batch_ms: int = settings.ingest_batch_ms,
+        emit: Callable[[str], None] | None = None,
     ) -> None:
         self.session = session
         self.queue = queue
+        self.emit = emit
+        self.batch_size = batch_size
+        self.batch_timeout = batch_ms / 1000
 
-    def get_asset(self, slug: str) -> Asset | None:
-        asset_ = self.session.execute(
-            select(Asset).filter_by(slug=slug)
-        ).scalar_one_or_none()
-
-        return asset_
-
-    def asset_from_cults(self, data: AssetFromCults) -> Asset:
-        tags = []
-        for label in data.tags:
-            tag_ = self.session.execute(
-                select(Tag).filter_by(label=label)
-            ).scalar_one_or_none()
-            if tag_:
-                tags.append(tag_)
-            else:
-                tag_ = Tag(label=label)
-                tags.append(tag_)
-
-        user = self.session.execute(
-            select(User).filter_by(nickname=data.creator.nickname)
-        ).scalar_one_or_none()
-        if not user:
-            user = User(nickname=data.creator.nickname)
-
-        illustrations = [Illustration(src=i.src) for i in data.illustrations]
-
-        return Asset(
-            name=data.name,
-            slug=data.slug,
-            details=data.details,
-            description=data.description,
-            cents=data.cents,
-            creator=user,
-            tags=tags,
-            illustrations=illustrations,
+    def insert(self, table: Table) -> Insert:
+        return DIALECT_INSERTS[self.session.bind.dialect.name](table)
+
+    def resolve_ids(self, cache: IdentityCache, keys: set[str]) -> dict[str, int]:
+        ids, missing = cache.get_many(self.session, keys)
+        if not missing:
+            return ids
+
+        table, column = cache.table, cache.table.c[cache.column]
+        self.session.execute(
+            self.insert(table).on_conflict_do_nothing(index_elements=[column.name]),
+            [{column.name: key} for key in missing],
         )
+        rows = self.session.execute(
+            select(column, table.c.id).where(column.in_(missing))
+        )
+        resolved = dict(rows.tuples().all())
 
-    async def run(self) -> NoReturn:
-        while True:
-            data = await self.queue.get()
+        cache.put(self.session, resolved)
+        ids.update(resolved)
+        return ids
 
-            try:
-                match data:
-                    case AssetFromCults():
-                        asset = self.get_asset(data.slug)
-                        if asset is None:
-                            asset = self.asset_from_cults(data)
-                            asset.yanked = False
-                            self.session.add(asset)
+    def _columns(
+        self, data: AssetFromCults, fingerprint: str, users: dict[str, int]
+    ) -> dict[str, Any]:
+        return {
+            "name": data.name,
+            "details": data.details,
+            "description": data.description,
+            "cents": data.cents,
+            "creator_id": users[data.creator.nickname],
+            "fingerprint": fingerprint,
+        }
 
-                        logger.debug(f"Processed asset {asset.slug} from cults")
+    def sync_assets(
+        self, assets: dict[str, AssetFromCults], liked: set[str]
+    ) -> tuple[dict[str, int], IngestCounts]:
+        fingerprints = {slug: data.fingerprint() for slug, data in assets.items()}
+        existing = self.session.execute(
+            select(Asset.slug, Asset.id, Asset.fingerprint).where(
+                Asset.slug.in_(assets)
+            )
+        )
 
-                    case OrderFromCults():
-                        asset = self.get_asset(data.creation.slug)
+        ids: dict[str, int] = {}
+        changed: dict[int, str] = {}
+        for slug, id, fingerprint in existing.tuples():
+            ids[slug] = id
+            if fingerprint != fingerprints[slug]:
+                changed[id] = slug
 
-                        if asset is None:
-                            asset = self.asset_from_cults(data.creation)
-                            asset.yanked = True
-                            self.session.add(asset)
+        new = [slug for slug in assets if slug not in ids]
+        counts = IngestCounts(unchanged=len(ids) - len(changed))
+        touched = [assets[slug] for slug in (*new, *changed.values())]
+        if not touched:
+            return ids, counts
 
-                        asset.download_url = data.download_url
+        users = self.resolve_ids(user_ids, {data.creator.nickname for data in touched})
+        tags = self.resolve_ids(
+            tag_ids, {label for data in touched for label in data.tags}
+        )
 
-                        logger.debug(f"Processed order for {asset.slug} from cults")
+        if new:
+            inserted = self.insert_assets(new, assets, liked, fingerprints, users, tags)
+            counts.new = len(inserted)
+            counts.new_free = sum(assets[slug].cents == 0 for slug in inserted)
+            ids.update(inserted)
 
-                self.session.commit()
+        if changed:
+            self.update_assets(changed, assets, fingerprints, users, tags)
+            counts.updated = len(changed)
 
-                self.queue.task_done()
+        return ids, counts
+
+    def insert_assets(
+        self,
+        new: list[str],
+        assets: dict[str, AssetFromCults],
+        liked: set[str],
+        fingerprints: dict[str, str],
+        users: dict[str, int],
+        tags: dict[str, int],
+    ) -> dict[str, int]:
+        # Only rows we actually inserted get children, a concurrent writer owns the rest
+        inserted = self.session.execute(
+            self.insert(Asset.__table__)
+            .on_conflict_do_nothing(index_elements=["slug"])
+            .returning(Asset.slug, Asset.id),
+            [
+                {
+                    "slug": slug,
+                    "yanked": slug not in liked,
+                    **self._columns(assets[slug], fingerprints[slug], users),
+                }
+                for slug in new
+            ],
+        )
+        ids = dict(inserted.tuples().all())
+
+        self._insert_children(
+            Illustration.__table__,
+            (
+                {"asset_id": id, "src": i.src}
+                for slug, id in ids.items()
+                for i in assets[slug].illustrations
+            ),
+        )
+        self._insert_children(
+            tag_association_table,
+            (
+                {"asset_id": id, "tag_id": tags[label]}
+                for slug, id in ids.items()
+                for label in set(assets[slug].tags)
+            ),
+        )
+
+        return ids
+
+    def update_assets(
+        self,
+        changed: dict[int, str],
+        assets: dict[str, AssetFromCults],
+        fingerprints: dict[str, str],
+        users: dict[str, int],
+        tags: dict[str, int],
+    ) -> None:
+        self.session.execute(
+            update(Asset),
+            [
+                {"id": id, **self._columns(assets[slug], fingerprints[slug], users)}
+                for id, slug in changed.items()
+            ],
+        )
+
+        association = tag_association_table.c
+        current = self.session.execute(
+            select(association.asset_id, association.tag_id).where(
+                association.asset_id.in_(changed)
+            )
+        )
+        current_tags = set(current.tuples().all())
+        wanted_tags = {
+            (id, tags[label])
+            for id, slug in changed.items()
+            for label in assets[slug].tags
+        }
+        if stale := current_tags - wanted_tags:
+            self.session.execute(
+                delete(tag_association_table).where(
+                    tuple_(association.asset_id, association.tag_id).in_(stale)
+                )
+            )
+        self._insert_children(
+            tag_association_table,
+            ({"asset_id": id, "tag_id": tag} for id, tag in wanted_tags - current_tags),
+        )
+
+        # Order decides the primary illustration, so any difference rewrites the set
+        current = self.session.execute(
+            select(Illustration.asset_id, Illustration.src)
+            .where(Illustration.asset_id.in_(changed))
+            .order_by(Illustration.id)
+        )
+        current_srcs = defaultdict(list)
+        for id, src in current.tuples():
+            current_srcs[id].append(src)
+
+        redo = {
+            id: [i.src for i in assets[slug].illustrations]
+            for id, slug in changed.items()
+        }
+        redo = {id: srcs for id, srcs in redo.items() if srcs != current_srcs[id]}
+        if redo:
+            self.session.execute(
+                delete(Illustration.__table__).where(
+                    Illustration.__table__.c.asset_id.in_(redo)
+                )
+            )
+            self._insert_children(
+                Illustration.__table__,
+                (
+                    {"asset_id": id, "src": src}
+                    for id, srcs in redo.items()
+                    for src in srcs
+                ),
+            )
+
+    def _insert_children(self, table: Table, rows: Iterable[dict[str, Any]]) -> None:
+        if rows := list(rows):
+            self.session.execute(self.insert(table).on_conflict_do_nothing(), rows)
+
+    def ingest(self, batch: list[AssetFromCults | OrderFromCults]) -> IngestCounts:
+        assets: dict[str, AssetFromCults] = {}
+        liked: set[str] = set()
+        download_urls: dict[str, str] = {}
+
+        for data in batch:
+            match data:
+                case AssetFromCults():
+                    assets[data.slug] = data
+                    liked.add(data.slug)
+
+                case OrderFromCults():
+                    assets.setdefault(data.creation.slug, data.creation)
+                    download_urls[data.creation.slug] = data.download_url
+
+        ids, counts = self.sync_assets(assets, liked)
+
+        if download_urls:
+            current = self.session.execute(
+                select(Asset.id, Asset.download_url).where(
+                    Asset.id.in_([ids[slug] for slug in download_urls])
+                )
+            )
+            current_urls = dict(current.tuples().all())
+            changed_urls = [
+                {"id": ids[slug], "download_url": url}
+                for slug, url in download_urls.items()
+                if current_urls.get(ids[slug]) != url
+            ]
+            if changed_urls:
+                self.session.execute(update(Asset), changed_urls)
+                counts.download_urls = len(changed_urls)
+                self.rearm_downloads([row["id"] for row in changed_urls])
+
+        self.session.commit()
+
+        if self.emit is not None:
+            if counts.new_free:
+                self.emit(NEW_FREE_ASSET)
+            if counts.download_urls:
+                self.emit(DOWNLOAD_URL_SET)
+        return counts
+
+    def rearm_downloads(self, asset_ids: list[int]) -> None:
+        # Downloads parked or backing off on the old URL start over on the new one,
+        # a job that is running right now keeps its lease
+        now = datetime.datetime.utcnow()
+        self.session.execute(
+            update(Job)
+            .where(
+                Job.kind == JobKind.DOWNLOAD,
+                Job.asset_id.in_(asset_ids),
+                Job.finished_at.is_(None),
+                or_(Job.leased_until.is_(None), Job.leased_until < now),
+            )
+            .values(
+                attempts=0,
+                available_at=now,
+                failed_at=None,
+                error=None,
+            ),
+            execution_options={"synchronize_session": False},
+        )
+
+    async def next_batch(self) -> list[AssetFromCults | OrderFromCults]:
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.batch_timeout
+
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except TimeoutError:
+                break
+
+        return batch
+
+    async def run(self) -> NoReturn:
+        while True:
+            batch = await self.next_batch()
+            start = time.perf_counter()
+
+            try:
+                counts = self.ingest(batch)
             except Exception:
-                logger.exception("Exception while ingesting data")
+                self.session.rollback()
+                logger.exception(f"Exception while ingesting {len(batch)} items")
+            else:
+                elapsed = time.perf_counter() - start
+                logger.info(
+                    f"Ingested {len(batch)} items in {elapsed:.3f}s "
+                    f"({len(batch) / elapsed:.1f} items/s), {counts.new} new, "
+                    f"{counts.updated} updated, {counts.unchanged} unchanged"
+                )
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
@@ -0,0 +1,117 @@
+import datetime
+import os
+import socket
+from logging import getLogger
+
+from sqlalchemy import ColumnElement, exists, insert, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..orms import Asset, Job, JobKind
+
+logger = getLogger(__name__)
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
+
+# Jobs live in the database so any number of workers, in this process or in
+# other replicas, can share them. A lease hides a job for the visibility timeout;
+# if its worker dies the lease lapses and the job is picked up again.
+class JobQueue:
+    def __init__(self, session: Session) -> None:
+        self.session = session
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+
+    def enqueue(
+        self, kind: JobKind, *criteria: ColumnElement[bool], priority: int = 0
+    ) -> int:
+        now = _now()
+        already = exists().where(Job.kind == kind, Job.asset_id == Asset.id)
+        assets = select(
+            Asset.id, literal(kind), literal(priority), literal(now), literal(now)
+        ).where(*criteria, ~already)
+
+        try:
+            res = self.session.execute(
+                insert(Job).from_select(
+                    ["asset_id", "kind", "priority", "available_at", "created_at"],
+                    assets,
+                )
+            )
+            self.session.commit()
+        except IntegrityError:
+            # Another replica enqueued the same assets first
+            self.session.rollback()
+            return 0
+
+        if res.rowcount:
+            logger.info(f"Enqueued {res.rowcount} {kind} jobs")
+        return res.rowcount
+
+    def lease(self, worker: str, kinds: list[JobKind]) -> Job | None:
+        now = _now()
+        # SKIP LOCKED lets concurrent workers pass over each other's candidates on
+        # Postgres, elsewhere the single UPDATE is what makes the claim atomic
+        candidate = (
+            select(Job.id)
+            .where(
+                Job.kind.in_(kinds),
+                Job.finished_at.is_(None),
+                Job.failed_at.is_(None),
+                Job.available_at <= now,
+                or_(Job.leased_until.is_(None), Job.leased_until < now),
+            )
+            .order_by(Job.priority.desc(), Job.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        job = self.session.scalars(
+            update(Job)
+            .where(Job.id.in_(candidate.scalar_subquery()))
+            .values(
+                attempts=Job.attempts + 1,
+                leased_by=worker,
+                leased_until=now + datetime.timedelta(seconds=settings.job_lease),
+            )
+            .returning(Job),
+            execution_options={"synchronize_session": False, "populate_existing": True},
+        ).one_or_none()
+        # Nothing was claimed, end the transaction without committing
+        if job is None:
+            self.session.rollback()
+        else:
+            self.session.commit()
+        return job
+
+    def extend(self, job: Job, worker: str) -> bool:
+        res = self.session.execute(
+            update(Job)
+            .where(Job.id == job.id, Job.leased_by == worker)
+            .values(
+                leased_until=_now() + datetime.timedelta(seconds=settings.job_lease)
+            )
+        )
+        self.session.commit()
+        return res.rowcount == 1
+
+    def complete(self, job: Job) -> None:
+        # Commits whatever the job added to the session along with it
+        job.finished_at = _now()
+        job.leased_until = None
+        job.error = None
+        self.session.commit()
+
+    def fail(self, job: Job, error: str) -> None:
+        self.session.rollback()
+        job.leased_until = None
+        job.error = error
+        if job.attempts >= settings.job_max_attempts:
+            job.failed_at = _now()
+            logger.error(f"Giving up on {job.kind} job {job.id}: {error}")
+        else:
+            delay = settings.job_retry_base * 2 ** (job.attempts - 1)
+            job.available_at = _now() + datetime.timedelta(seconds=delay)
+        self.session.commit()
@@ -1,28 +1,76 @@
+import datetime
 from asyncio import Queue
+from collections.abc import AsyncIterator, Callable
 from logging import getLogger
 
-from ..connectors.cults_client import CultsGraphQLClient
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..connectors.cults_client import CultsGraphQLClient, Page, SyncStats
 from ..connectors.cults_models import AssetFromCults, OrderFromCults
+from ..orms import SyncState
 
 logger = getLogger(__name__)
 
+Fetcher = Callable[
+    [str | None, SyncStats], AsyncIterator[Page[AssetFromCults | OrderFromCults]]
+]
+
 
 class Scraper:
     def __init__(
-        self, client: CultsGraphQLClient, queue: Queue[AssetFromCults | OrderFromCults]
+        self,
+        client: CultsGraphQLClient,
+        session: Session,
+        queue: Queue[AssetFromCults | OrderFromCults],
     ) -> None:
         self.client = client
+        self.session = session
         self.queue = queue
 
-    async def fetch_liked(self) -> None:
-        liked = await self.client._get_liked()
-        for creation in liked:
-            asset = AssetFromCults.model_validate(creation)
-            await self.queue.put(asset)
-
-    async def fetch_orders(self) -> None:
-        orders = await self.client._get_orders()
-        for order in orders:
-            for line in order["lines"]:
-                order = OrderFromCults.model_validate(line)
-                await self.queue.put(order)
+    async def _sync(self, name: str, fetch: Fetcher, full: bool) -> int:
+        since = None
+        if not full:
+            since = self.session.scalar(
+                select(SyncState.watermark).where(SyncState.name == name)
+            )
+        stats = SyncStats()
+        head = None
+        total = 0
+
+        async for page in fetch(since, stats):
+            head = head or page.head
+            total += len(page.items)
+            for item in page.items:
+                await self.queue.put(item)
+
+        now = datetime.datetime.utcnow()
+        state = self.session.get(SyncState, name) or SyncState(name=name)
+        if head is not None:
+            state.watermark = head
+        if full:
+            state.reconciled_at = now
+        state.synced_at = now
+        state.requests = stats.requests
+        state.bytes = stats.bytes
+        self.session.add(state)
+        self.session.commit()
+
+        mode = "full" if full else "incremental"
+        logger.info(
+            f"Synced {name} ({mode}): {total} items in "
+            f"{stats.requests} requests, {stats.bytes} bytes"
+        )
+        return total
+
+    async def fetch_liked(self) -> int:
+        return await self._sync("liked", self.client._get_liked, full=False)
+
+    async def fetch_orders(self) -> int:
+        return await self._sync("orders", self.client._get_orders, full=False)
+
+    async def reconcile_liked(self) -> int:
+        return await self._sync("liked", self.client._get_liked, full=True)
+
+    async def reconcile_orders(self) -> int:
+        return await self._sync("orders", self.client._get_orders, full=True)
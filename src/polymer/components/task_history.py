@@ -0,0 +1,92 @@
+import asyncio
+import bisect
+import datetime
+import math
+from collections import Counter, deque
+from logging import getLogger
+from typing import TYPE_CHECKING, Any, NoReturn
+
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..orms import TaskOutcome, TaskRun
+
+if TYPE_CHECKING:
+    from ..lifespan import TaskManager
+
+logger = getLogger(__name__)
+
+
+# The last `size` runs of one task, with durations kept sorted as runs come and
+# go so percentiles are a lookup rather than a sort or a table scan.
+class RollingStats:
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.window: deque[tuple[str, float | None]] = deque()
+        self.durations: list[float] = []
+        self.outcomes: Counter[str] = Counter()
+
+    def add(self, outcome: str, duration: float | None) -> None:
+        self.window.append((outcome, duration))
+        self.outcomes[outcome] += 1
+        if duration is not None:
+            bisect.insort(self.durations, duration)
+
+        if len(self.window) > self.size:
+            outcome, duration = self.window.popleft()
+            self.outcomes[outcome] -= 1
+            if duration is not None:
+                del self.durations[bisect.bisect_left(self.durations, duration)]
+
+    def percentile(self, p: float) -> float | None:
+        if not self.durations:
+            return None
+        return self.durations[max(math.ceil(p * len(self.durations)) - 1, 0)]
+
+    @property
+    def failure_rate(self) -> float | None:
+        finished = self.outcomes[TaskOutcome.OK] + self.outcomes[TaskOutcome.FAILED]
+        if not finished:
+            return None
+        return self.outcomes[TaskOutcome.FAILED] / finished
+
+
+class TaskHistory:
+    def __init__(self, session: Session, manager: "TaskManager") -> None:
+        self.session = session
+        self.manager = manager
+
+    def warm(self) -> None:
+        for spec in self.manager.specs:
+            runs = self.session.scalars(
+                TaskRun.select_recent(spec.name, spec.stats.size)
+            )
+            for run in reversed(runs.all()):
+                spec.stats.add(run.outcome, run.duration)
+
+    def flush(self) -> None:
+        rows: list[dict[str, Any]]
+        rows, self.manager.runs = self.manager.runs, []
+        if not rows:
+            return
+
+        try:
+            self.session.execute(insert(TaskRun), rows)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            logger.exception(f"Dropped {len(rows)} task runs")
+
+    async def run(self) -> NoReturn:
+        while True:
+            await asyncio.sleep(settings.task_run_flush_interval)
+            self.flush()
+
+    async def prune(self) -> int:
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+            days=settings.task_run_retention_days
+        )
+        res = self.session.execute(delete(TaskRun).where(TaskRun.started_at < cutoff))
+        self.session.commit()
+        return res.rowcount
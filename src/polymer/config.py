@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -12,6 +14,44 @@ class Settings(BaseSettings):
     download_dir: str
     mmf_client_id: str
     mmf_client_secret: str
+    count_cache_ttl: float = 60.0
+    count_cache_size: int = 1000
+    ingest_batch_size: int = 500
+    ingest_batch_ms: int = 250
+    ingest_queue_size: int = 1000
+    graphql_persisted_queries: bool = False
+    identity_cache_size: int = 10_000
+    http_timeout: float = 20.0
+    http_retries: int = 4
+    http_backoff_base: float = 0.5
+    http_backoff_max: float = 60.0
+    http_slow_seconds: float = 5.0
+    rate_limit_rate: float = 1.0
+    rate_limit_min: float = 0.1
+    rate_limit_max: float = 5.0
+    rate_limit_burst: int = 3
+    rate_limit_increase: float = 0.05
+    rate_limit_decrease: float = 0.5
+    cults_session_check_interval: float = 300.0
+    cults_token_ttl: float = 600.0
+    download_block_size: int = 1 << 20
+    file_offload: Literal["x-accel-redirect", "x-sendfile"] | None = None
+    file_offload_prefix: str = "/protected/"
+    job_workers: int = 8
+    job_lease: float = 900.0
+    job_max_attempts: int = 5
+    job_retry_base: float = 60.0
+    job_poll_interval: float = 5.0
+    download_concurrency: int = 3
+    download_concurrency_min: int = 1
+    download_concurrency_max: int = 8
+    download_bandwidth_cap: float | None = None
+    download_adjust_interval: float = 10.0
+    task_run_window: int = 200
+    task_run_flush_interval: float = 30.0
+    task_run_retention_days: int = 30
+    leader_poll_interval: float = 15.0
+    leader_heartbeat_interval: float = 5.0
 
 
 settings = Settings()
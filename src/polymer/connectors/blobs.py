@@ -0,0 +1,87 @@
+import os
+from collections.abc import Iterator
+from dataclasses import dataclass
+from logging import getLogger
+from pathlib import Path
+
+from ..config import settings
+from .downloads import file_sha256
+
+logger = getLogger(__name__)
+
+
+@dataclass
+class Adopted:
+    path: Path
+    sha256: str
+    size: int
+    deduped: bool
+
+
+# Content addressed files under <root>/.blobs/ab/abcdef..., the <slug>/<filename>
+# tree holds hardlinks into it so identical archives share one copy on disk.
+class BlobStore:
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.blobs = root / ".blobs"
+
+    def path(self, sha256: str) -> Path:
+        return self.blobs / sha256[:2] / sha256
+
+    def link(self, blob: Path, dest: Path) -> None:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(f".{dest.name}.link")
+        tmp.unlink(missing_ok=True)
+        try:
+            os.link(blob, tmp)
+        except OSError:
+            # Filesystems without hardlinks still get a single copy. Relative to
+            # the link itself, since download_dir may be relative to the cwd
+            os.symlink(os.path.relpath(blob, dest.parent), tmp)
+        os.replace(tmp, dest)
+
+    def publish(self, src: Path, sha256: str, dest: Path) -> Path:
+        blob = self.path(sha256)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        if blob.exists():
+            src.unlink()
+        else:
+            os.replace(src, blob)
+
+        self.link(blob, dest)
+        return blob
+
+    def adopt(self, path: Path) -> Adopted:
+        sha256 = file_sha256(path)
+        size = path.stat().st_size
+        blob = self.path(sha256)
+
+        if blob.exists():
+            deduped = not os.path.samefile(blob, path)
+            if deduped:
+                self.link(blob, path)
+        else:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            os.link(path, blob)
+            deduped = False
+
+        return Adopted(path, sha256, size, deduped)
+
+    def unadopted(self) -> Iterator[Path]:
+        # Nothing has been downloaded yet
+        if not self.root.is_dir():
+            return
+
+        # Anything already in the store has a second link
+        for directory in self.root.iterdir():
+            if directory.name.startswith(".") or not directory.is_dir():
+                continue
+
+            for path in directory.iterdir():
+                if path.name.startswith(".") or path.is_symlink():
+                    continue
+                if path.is_file() and path.stat().st_nlink == 1:
+                    yield path
+
+
+blob_store = BlobStore(Path(settings.download_dir))
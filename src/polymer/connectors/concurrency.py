@@ -0,0 +1,138 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from logging import getLogger
+
+from ..config import settings
+
+logger = getLogger(__name__)
+
+# Throughput has to move by this much before it counts as better or worse
+GAIN = 0.1
+DECREASE = 0.5
+
+
+# Limits in-flight downloads, tuned once per window from what the last window
+# measured: errors or slow responses halve the limit, and while every slot is
+# busy the limit grows by one for as long as that keeps raising throughput.
+class AdaptiveConcurrency:
+    def __init__(self) -> None:
+        self.limit = float(settings.download_concurrency)
+        self.min_limit = settings.download_concurrency_min
+        self.max_limit = settings.download_concurrency_max
+        self.cap = settings.download_bandwidth_cap
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+
+        self.allowance = float(self.cap or 0)
+        self.refilled = time.monotonic()
+
+        self.throughput: float | None = None
+        self.baseline: float | None = None
+        self.latency: float | None = None
+        self._reset_window(time.monotonic())
+
+        self.bytes = 0
+        self.completed = 0
+        self.errors = 0
+
+    @property
+    def concurrency(self) -> int:
+        return int(self.limit)
+
+    def available(self) -> bool:
+        return self.in_flight < self.concurrency
+
+    def _reset_window(self, now: float) -> None:
+        self.window_start = now
+        self.window_bytes = 0
+        self.window_errors = 0
+        self.window_latency: list[float] = []
+        self.window_peak = self.in_flight
+        self.window_capped = False
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        async with self.condition:
+            await self.condition.wait_for(self.available)
+            self.in_flight += 1
+            self.window_peak = max(self.window_peak, self.in_flight)
+
+        try:
+            yield
+        except Exception:
+            self.errors += 1
+            self.window_errors += 1
+            raise
+        else:
+            self.completed += 1
+        finally:
+            self._maybe_adjust()
+            async with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def responded(self, latency: float) -> None:
+        self.window_latency.append(latency)
+
+    async def transferred(self, n: int) -> None:
+        self.bytes += n
+        self.window_bytes += n
+        self._maybe_adjust()
+
+        if not self.cap:
+            return
+
+        # Shared token bucket of bytes, a second's worth of burst
+        now = time.monotonic()
+        self.allowance = min(
+            self.cap, self.allowance + (now - self.refilled) * self.cap
+        )
+        self.refilled = now
+        self.allowance -= n
+        if self.allowance < 0:
+            self.window_capped = True
+            await asyncio.sleep(-self.allowance / self.cap)
+
+    def _maybe_adjust(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed < settings.download_adjust_interval:
+            return
+
+        if self.window_bytes or self.window_errors:
+            self._adjust(self.window_bytes / elapsed)
+        self._reset_window(now)
+
+    def _adjust(self, throughput: float) -> None:
+        limit = self.limit
+        slow = False
+        if self.window_latency:
+            self.latency = sum(self.window_latency) / len(self.window_latency)
+            slow = self.latency > settings.http_slow_seconds
+
+        baseline = throughput
+        if self.window_errors or slow:
+            limit = max(self.min_limit, limit * DECREASE)
+            # Start probing afresh rather than against pre-trouble numbers
+            baseline = None
+        elif self.window_capped or self.window_peak < self.concurrency:
+            # Not limited by concurrency, so these numbers say nothing about it
+            pass
+        elif self.baseline is None or throughput > self.baseline * (1 + GAIN):
+            limit = min(self.max_limit, limit + 1)
+        elif throughput < self.baseline * (1 - GAIN):
+            limit = max(self.min_limit, limit - 1)
+
+        if int(limit) != self.concurrency:
+            logger.info(
+                f"Download concurrency {self.concurrency} -> {int(limit)} at "
+                f"{throughput / 1e6:.2f} MB/s"
+            )
+        self.limit = limit
+        self.baseline = baseline
+        self.throughput = throughput
+
+
+download_concurrency = AdaptiveConcurrency()
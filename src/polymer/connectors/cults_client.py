@@ -1,38 +1,164 @@
+import asyncio
+import datetime
+import hashlib
+import html
+import re
+import time
+from asyncio import Task, create_task
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+from hashlib import sha256
 from importlib.resources import files
-from itertools import count
 from logging import getLogger
 from pathlib import Path
-from typing import Any
+from typing import Any, Generic, TypeVar
 
 import httpx
 import pyrfc6266
 from bs4 import BeautifulSoup
+from graphql import (
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    Node,
+    OperationDefinitionNode,
+    Visitor,
+    parse,
+    print_ast,
+    visit,
+)
+from sqlalchemy.orm import Session
 
 from ..config import settings
+from ..orms import CultsLogin
+from .blobs import blob_store
+from .concurrency import download_concurrency
+from .cults_models import AssetFromCults, OrderFromCults
+from .downloads import (
+    DownloadResult,
+    IncompleteDownload,
+    Partial,
+    content_span,
+    expected_sha256,
+    file_sha256,
+    file_writer,
+    hash_file,
+    range_headers,
+    validator,
+)
 
 logger = getLogger(__name__)
 
 TIME_ZONE = "America/New_York"
+HOME_URL = "https://cults3d.com"
+SIGN_IN_PATH = "/users/sign-in"
+SIGN_IN_URL = f"https://cults3d.com/en{SIGN_IN_PATH}"
+SESSION_CHECK_URL = "https://cults3d.com/en/users/edit"
 USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36"
 GRAPHQL = files(__package__).joinpath("cults.graphql").read_text()
+PAGE_SIZE = 100
+ORDERS = ("data", "me", "orders")
+LIKED = ("data", "myself", "user", "likedCreations")
 
 
-def _get_csrf(html: BeautifulSoup) -> str:
-    return html.find("meta", {"name": "csrf-token"})["content"]
+class _SpreadCollector(Visitor):
+    def __init__(self) -> None:
+        super().__init__()
+        self.names: set[str] = set()
 
+    def enter_fragment_spread(self, node: FragmentSpreadNode, *_: Any) -> None:
+        self.names.add(node.name.value)
 
-def _get_authenticity(html: BeautifulSoup) -> str:
-    return html.find("input", {"name": "authenticity_token"})["value"]
 
+def _spreads(node: Node) -> set[str]:
+    collector = _SpreadCollector()
+    visit(node, collector)
+    return collector.names
 
-def _with_csrf(data: dict[str, Any], html: BeautifulSoup) -> dict[str, Any]:
-    data.update({"X-CSRF-Token": _get_csrf(html)})
-    return data
 
+def _split_operations(source: str) -> dict[str, str]:
+    # Each request only carries its own operation and the fragments it reaches
+    definitions = parse(source).definitions
+    fragments = {
+        d.name.value: d for d in definitions if isinstance(d, FragmentDefinitionNode)
+    }
 
-def _with_authenticity(data: dict[str, Any], html: BeautifulSoup) -> dict[str, Any]:
-    data.update({"authenticity_token": _get_authenticity(html)})
-    return data
+    documents = {}
+    for operation in definitions:
+        if not isinstance(operation, OperationDefinitionNode):
+            continue
+
+        used: set[str] = set()
+        todo = _spreads(operation)
+        while todo:
+            name = todo.pop()
+            used.add(name)
+            todo |= _spreads(fragments[name]) - used
+
+        nodes = (operation, *(fragments[name] for name in sorted(used)))
+        documents[operation.name.value] = "\n\n".join(map(print_ast, nodes))
+
+    return documents
+
+
+DOCUMENTS = _split_operations(GRAPHQL)
+HASHES = {
+    name: sha256(document.encode()).hexdigest() for name, document in DOCUMENTS.items()
+}
+
+
+CSRF_META = re.compile(r"<meta\s[^>]*name=[\"']csrf-token[\"'][^>]*>", re.I)
+AUTHENTICITY_INPUT = re.compile(
+    r"<input\s[^>]*name=[\"']authenticity_token[\"'][^>]*>", re.I
+)
+CONTENT_ATTR = re.compile(r"\scontent=[\"']([^\"']*)[\"']", re.I)
+VALUE_ATTR = re.compile(r"\svalue=[\"']([^\"']*)[\"']", re.I)
+
+
+@dataclass
+class Tokens:
+    csrf: str
+    authenticity: str
+    fetched_at: float
+
+
+def _find_attr(tag: re.Pattern, attr: re.Pattern, text: str) -> str | None:
+    if (element := tag.search(text)) and (value := attr.search(element.group())):
+        return html.unescape(value.group(1))
+    return None
+
+
+async def _extract_tokens(res: httpx.Response) -> tuple[str, str]:
+    # Reads only as far as needed, both tags sit near the top of every page
+    text = ""
+    csrf = authenticity = None
+    async for chunk in res.aiter_text():
+        text += chunk
+        csrf = csrf or _find_attr(CSRF_META, CONTENT_ATTR, text)
+        authenticity = authenticity or _find_attr(AUTHENTICITY_INPUT, VALUE_ATTR, text)
+        if csrf and authenticity:
+            return csrf, authenticity
+
+    raise RuntimeError(f"No CSRF tokens found in {res.url}")
+
+
+def _size(path: Path) -> int | None:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return None
+
+
+class SessionExpired(RuntimeError):
+    pass
+
+
+def _is_sign_in(res: httpx.Response) -> bool:
+    location = res.headers.get("Location", "") if res.is_redirect else ""
+    return (
+        res.status_code == 401
+        or res.url.path.endswith(SIGN_IN_PATH)
+        or location.split("?")[0].endswith(SIGN_IN_PATH)
+    )
 
 
 class CultsInfra:
@@ -42,16 +168,18 @@ class CultsInfra:
         self.password = settings.password
         self.time_zone = TIME_ZONE
         self.user_agent = USER_AGENT
+        self.login_lock = asyncio.Lock()
+        self.restored = False
+        self.checked_at: float | None = None
+        self.tokens: Tokens | None = None
 
     async def login(self) -> None:
-        html = await self.get_parsed(
-            "https://cults3d.com/en/users/sign-in", follow_redirects=True
-        )
+        tokens = await self.get_tokens(SIGN_IN_URL, refresh=True)
 
         # Session state is cookie based, just need to post a sign-in
-        await self.post_parsed(
-            "https://cults3d.com/en/users/sign-in",
-            html=html,
+        await self.post_form(
+            SIGN_IN_URL,
+            tokens=tokens,
             data={
                 "user[email]": self.email,
                 "user[password]": self.password,
@@ -60,65 +188,244 @@ class CultsInfra:
             },
             follow_redirects=True,
         )
+        # Tokens are bound to the session, signing in rotates them
+        self.tokens = None
+
+    async def session_valid(self) -> bool:
+        res = await self.client.head(SESSION_CHECK_URL, follow_redirects=False)
+        return res.is_success and not _is_sign_in(res)
+
+    def _restore_cookies(self, login: CultsLogin) -> None:
+        now = time.time()
+        for cookie in login.cookies:
+            if cookie["expires"] is None or cookie["expires"] > now:
+                self.client.cookies.set(
+                    cookie["name"],
+                    cookie["value"],
+                    domain=cookie["domain"],
+                    path=cookie["path"],
+                )
+
+    def _dump_cookies(self) -> list[dict[str, Any]]:
+        return [
+            {
+                "name": c.name,
+                "value": c.value,
+                "domain": c.domain,
+                "path": c.path,
+                "expires": c.expires,
+            }
+            for c in self.client.cookies.jar
+        ]
+
+    async def ensure_session(self, session: Session) -> None:
+        # Concurrent callers queue here, then reuse whatever the first one found
+        async with self.login_lock:
+            now = time.monotonic()
+            if (
+                self.checked_at is not None
+                and now - self.checked_at < settings.cults_session_check_interval
+            ):
+                return
+
+            login = session.get(CultsLogin, self.email)
+            if not self.restored and login is not None:
+                self._restore_cookies(login)
+            self.restored = True
+
+            if await self.session_valid():
+                if login is not None:
+                    login.checked_at = datetime.datetime.utcnow()
+            else:
+                logger.info(f"Cults session for {self.email} expired, logging in")
+                await self.login()
+                session.merge(
+                    CultsLogin(
+                        email=self.email,
+                        cookies=self._dump_cookies(),
+                        logged_in_at=datetime.datetime.utcnow(),
+                    )
+                )
+
+            session.commit()
+            self.checked_at = time.monotonic()
+
+    def _check_session(self, url: str, res: httpx.Response) -> None:
+        if url != SIGN_IN_URL and _is_sign_in(res):
+            self.checked_at = None
+            raise SessionExpired(f"Cults session expired while requesting {url}")
+
+    async def get_tokens(self, url: str = HOME_URL, refresh: bool = False) -> Tokens:
+        tokens = self.tokens
+        if (
+            refresh
+            or tokens is None
+            or time.monotonic() - tokens.fetched_at > settings.cults_token_ttl
+        ):
+            async with self.client.stream("GET", url, follow_redirects=True) as res:
+                self._check_session(url, res)
+                res.raise_for_status()
+                csrf, authenticity = await _extract_tokens(res)
+
+            tokens = self.tokens = Tokens(csrf, authenticity, time.monotonic())
+
+        return tokens
 
     async def get_parsed(
         self, url: str, follow_redirects: bool = False
     ) -> BeautifulSoup:
         res = await self.client.get(url, follow_redirects=follow_redirects)
+        self._check_session(url, res)
         res.raise_for_status()
         return BeautifulSoup(res.text, "html.parser")
 
-    async def post_parsed(
+    async def post_form(
         self,
         url: str,
         *,
-        html: BeautifulSoup,
+        tokens: Tokens | None = None,
         data: dict[str, Any] | None = None,
         headers: dict[str, Any] | None = None,
         params: dict[str, Any] | None = None,
         follow_redirects: bool = False,
         ignore_error: bool = False,  # custom, sign-in will 400 even when it works sometime
-    ) -> BeautifulSoup:
-        res = await self.client.post(
-            url,
-            data=_with_authenticity(data or {}, html),
-            headers=_with_csrf(headers or {"User-Agent": self.user_agent}, html),
-            params=params,
-            follow_redirects=follow_redirects,
-        )
+    ) -> httpx.Response:
+        tokens = tokens or await self.get_tokens()
+
+        for retry in (True, False):
+            res = await self.client.post(
+                url,
+                data={**(data or {}), "authenticity_token": tokens.authenticity},
+                headers={
+                    **(headers or {"User-Agent": self.user_agent}),
+                    "X-CSRF-Token": tokens.csrf,
+                },
+                params=params,
+                follow_redirects=follow_redirects,
+            )
+            self._check_session(url, res)
+
+            # Rails answers a stale token with 422
+            if res.status_code != 422 or not retry:
+                break
+            tokens = await self.get_tokens(refresh=True)
+
         if not ignore_error:
             res.raise_for_status()
+        return res
+
+    async def post_parsed(self, url: str, **kwargs: Any) -> BeautifulSoup:
+        res = await self.post_form(url, **kwargs)
         return BeautifulSoup(res.text, "html.parser")
 
 
 class CultsClient(CultsInfra):
     async def _free_order(self, creation: str) -> None:
-        html = await self.get_parsed("https://cults3d.com")
-
-        await self.post_parsed(
+        await self.post_form(
             f"https://cults3d.com/en/free_orders",
-            html=html,
             params={"creation_slug": creation},
             follow_redirects=True,
         )
 
-    async def _download_order(self, slug: str, download_url: str) -> None:
+    async def _download_order(self, slug: str, download_url: str) -> DownloadResult:
+        root = Path(settings.download_dir)
+        partial = Partial(root, slug)
+        offset, meta = await asyncio.to_thread(partial.resume_point)
+        began = time.monotonic()
+
         async with self.client.stream(
-            "GET", download_url, follow_redirects=True
+            "GET",
+            download_url,
+            headers=range_headers(offset, meta),
+            follow_redirects=True,
         ) as response:
+            download_concurrency.responded(time.monotonic() - began)
+            self._check_session(download_url, response)
+            if response.status_code == 416:
+                # Whatever we kept no longer matches the file, start over next run
+                await asyncio.to_thread(partial.discard)
+            response.raise_for_status()
+
             filename = pyrfc6266.parse_filename(response.headers["Content-Disposition"])
+            start, total = content_span(response)
+            dest = root.joinpath(slug, filename)
+
+            # Written by an earlier run that died before recording it
+            if total is not None and await asyncio.to_thread(_size, dest) == total:
+                await asyncio.to_thread(partial.discard)
+                return DownloadResult(
+                    filename, total, await asyncio.to_thread(file_sha256, dest)
+                )
 
-            dest = Path(settings.download_dir).joinpath(slug, filename)
-            if dest.exists():
-                return filename
+            if start not in (0, offset):
+                await asyncio.to_thread(partial.discard)
+                raise IncompleteDownload(
+                    f"Asked {download_url} for byte {offset}, got {start}"
+                )
 
-            dest.parent.mkdir(parents=True, exist_ok=True)
+            hasher = hashlib.sha256()
+            if start:
+                await asyncio.to_thread(hash_file, partial.part, hasher, start)
+            else:
+                await asyncio.to_thread(partial.discard)
+            await asyncio.to_thread(
+                partial.save,
+                {
+                    "filename": filename,
+                    "validator": validator(response),
+                    "total": total,
+                },
+            )
 
-            with dest.open("wb") as f:
+            size = start
+            async with file_writer(
+                partial.part, start, hasher, settings.download_block_size
+            ) as writer:
                 async for chunk in response.aiter_bytes():
-                    f.write(chunk)
+                    await writer.write(chunk)
+                    await download_concurrency.transferred(len(chunk))
+                    size += len(chunk)
+
+        if total is not None and size != total:
+            if size > total:
+                await asyncio.to_thread(partial.discard)
+            raise IncompleteDownload(f"Got {size} of {total} bytes for {slug}")
+
+        digest = hasher.hexdigest()
+        if (expected := expected_sha256(response)) and expected != digest:
+            await asyncio.to_thread(partial.discard)
+            raise IncompleteDownload(f"SHA-256 mismatch for {slug}")
+
+        await asyncio.to_thread(blob_store.publish, partial.part, digest, dest)
+        await asyncio.to_thread(partial.discard)
+
+        elapsed = time.monotonic() - began
+        logger.info(
+            f"Downloaded {slug}: {size - start} bytes in {elapsed:.1f}s "
+            f"({(size - start) / elapsed / 1e6:.2f} MB/s)"
+            + (f", resumed at byte {start}" if start else "")
+        )
+        return DownloadResult(filename, size, digest, start, elapsed)
 
-        return filename
+
+T = TypeVar("T")
+
+
+@dataclass
+class Page(Generic[T]):
+    head: str | None
+    items: list[T]
+
+
+@dataclass
+class SyncStats:
+    requests: int = 0
+    bytes: int = 0
+
+
+def _is_known(items: list[dict[str, Any]], since: str | None) -> bool:
+    # Results are newest first, so a page holding the previous head ends the new items
+    return since is not None and any(str(item["id"]) == since for item in items)
 
 
 class CultsGraphQLClient:
@@ -126,64 +433,157 @@ class CultsGraphQLClient:
         self.nickname = settings.nickname
         self.api_key = settings.apikey
         self.client = client
+        self.persisted_queries = settings.graphql_persisted_queries
 
-    async def graphql(self, operation: str, **variables: str) -> Any:
+    async def _post(self, body: dict[str, Any], stats: SyncStats | None) -> Any:
         try:
             res = await self.client.post(
                 "https://cults3d.com/graphql",
                 auth=(self.nickname, self.api_key),
-                json={
-                    "query": GRAPHQL,
-                    "operationName": operation,
-                    "variables": variables,
-                },
-                timeout=20.0,
+                json=body,
+                extensions={"retry": True},  # Reads only, safe to resend
             )
         except httpx.ReadTimeout as e:
-            raise RuntimeError(f"GraphQL timed out, {operation=} {variables=}") from e
+            raise RuntimeError(
+                f"GraphQL timed out, operation={body['operationName']} "
+                f"variables={body['variables']}"
+            ) from e
         res.raise_for_status()
-        return res.json()
 
-    async def _get_orders(self) -> list:
-        _result = []
-        limit = 100
+        if stats is not None:
+            stats.requests += 1
+            stats.bytes += len(res.content)
 
-        for offset in count(step=limit):
-            data = await self.graphql("ListOrders", offset=offset, limit=limit)
+        return res.json()
 
+    async def graphql(
+        self, operation: str, stats: SyncStats | None = None, **variables: Any
+    ) -> Any:
+        body: dict[str, Any] = {"operationName": operation, "variables": variables}
+
+        if self.persisted_queries:
+            body["extensions"] = {
+                "persistedQuery": {"version": 1, "sha256Hash": HASHES[operation]}
+            }
+            data = await self._post(body, stats)
+
+            errors = {e["message"] for e in data.get("errors", [])}
+            if "PersistedQueryNotSupported" in errors:
+                logger.info("Server rejected persisted queries, sending full documents")
+                self.persisted_queries = False
+                del body["extensions"]
+            elif "PersistedQueryNotFound" not in errors:
+                return data
+
+        # Registers the hash too when the persisted lookup missed
+        body["query"] = DOCUMENTS[operation]
+        return await self._post(body, stats)
+
+    async def _pages(
+        self,
+        operation: str,
+        path: tuple[str, ...],
+        since: str | None,
+        stats: SyncStats | None,
+        prefetch: bool,
+        total: int | None = None,
+    ) -> AsyncIterator[list[dict[str, Any]]]:
+        async def fetch(offset: int, limit: int) -> list[dict[str, Any]]:
+            data = await self.graphql(operation, stats, offset=offset, limit=limit)
             if "errors" in data:
                 raise RuntimeError(
-                    "Error while listing orders: "
+                    f"Error while running {operation}: "
                     + ", ".join(e["message"] for e in data["errors"])
                 )
 
-            orders = data["data"]["me"]["orders"]
-            _result.extend(orders)
-
-            if len(orders) < limit:
-                break
-
-        return _result
+            for key in path:
+                data = data[key]
+            return data
 
-    def _flatten_orders(self, orders: list) -> list[str]:
-        return [line["creation"] for order in orders for line in order["lines"]]
-
-    async def _get_liked(self) -> list:
-        _result = []
-        limit = 100
-
-        for offset in count(step=limit):
-            data = await self.graphql("LikedCreations", offset=offset, limit=limit)
-            if "errors" in data:
-                raise RuntimeError(
-                    "Error while getting liked: "
-                    + ", ".join(e["message"] for e in data["errors"])
-                )
+        def limit_at(offset: int) -> int:
+            if total is None:
+                return PAGE_SIZE
+            return min(PAGE_SIZE, total - offset)
 
-            liked = data["data"]["myself"]["user"]["likedCreations"]
-            _result.extend(liked)
+        if total == 0:
+            return
 
-            if len(liked) < limit:
-                break
+        pending: Task | None = None
+        offset = 0
+        try:
+            while True:
+                limit = limit_at(offset)
+                page = await (pending or fetch(offset, limit))
+                pending = None
+                offset += limit
+
+                if (
+                    len(page) < limit
+                    or _is_known(page, since)
+                    or (total is not None and offset >= total)
+                ):
+                    yield page
+                    break
+
+                # Next request is in flight while the caller handles this page
+                if prefetch:
+                    pending = create_task(fetch(offset, limit_at(offset)))
+                yield page
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    async def _count_new(
+        self,
+        operation: str,
+        path: tuple[str, ...],
+        since: str,
+        stats: SyncStats | None,
+    ) -> int:
+        # Walks ids only, results are newest first so new items are a prefix
+        total = 0
+        async for page in self._pages(operation, path, since, stats, prefetch=False):
+            for item in page:
+                if str(item["id"]) == since:
+                    return total
+                total += 1
+
+        return total
+
+    async def _get_orders(
+        self,
+        since: str | None = None,
+        stats: SyncStats | None = None,
+        prefetch: bool = True,
+    ) -> AsyncIterator[Page[OrderFromCults]]:
+        total = None
+        if since is not None:
+            total = await self._count_new("ListOrderIds", ORDERS, since, stats)
+
+        pages = self._pages("ListOrders", ORDERS, since, stats, prefetch, total)
+        async for orders in pages:
+            yield Page(
+                head=str(orders[0]["id"]) if orders else None,
+                items=[
+                    OrderFromCults.model_validate(line)
+                    for order in orders
+                    for line in order["lines"]
+                ],
+            )
 
-        return _result
+    async def _get_liked(
+        self,
+        since: str | None = None,
+        stats: SyncStats | None = None,
+        prefetch: bool = True,
+    ) -> AsyncIterator[Page[AssetFromCults]]:
+        total = None
+        if since is not None:
+            total = await self._count_new("LikedCreationIds", LIKED, since, stats)
+
+        pages = self._pages("LikedCreations", LIKED, since, stats, prefetch, total)
+        async for liked in pages:
+            yield Page(
+                head=str(liked[0]["id"]) if liked else None,
+                items=[AssetFromCults.model_validate(creation) for creation in liked],
+            )
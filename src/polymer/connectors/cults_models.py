@@ -1,3 +1,5 @@
+import json
+from hashlib import sha256
 from typing import Annotated
 
 from pydantic import AliasPath, BaseModel, Field
@@ -21,6 +23,11 @@ class AssetFromCults(BaseModel):
     illustrations: list[IllustrationsFromCults]
     tags: list[str]
 
+    def fingerprint(self) -> str:
+        data = self.model_dump(mode="json")
+        data["tags"] = sorted(set(self.tags))
+        return sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
 
 class OrderFromCults(BaseModel):
     creation: AssetFromCults
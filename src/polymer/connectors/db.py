@@ -1,14 +1,228 @@
-from typing import Any, Iterable, Protocol, TypeVar
+import datetime
+import json
+import operator
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import Any, Hashable, Iterable, Protocol, Sequence, TypeVar
 
-from sqlalchemy import Select, func, select
-from sqlalchemy.orm import Session
+from fastapi import HTTPException
+from sqlalchemy import (
+    ColumnElement,
+    DateTime,
+    Dialect,
+    Select,
+    event,
+    func,
+    inspect,
+    or_,
+    select,
+    text,
+    tuple_,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import ORMExecuteState, Session, object_mapper
+from sqlalchemy.sql.util import find_tables
+
+from ..config import settings
+from ..orms._base import nullable
 
 T = TypeVar("T")
 
 
+class CountStrategy(StrEnum):
+    EXACT = "exact"
+    CACHED = "cached"
+    ESTIMATE = "estimate"
+
+
+@dataclass
+class Total:
+    count: int
+    strategy: CountStrategy
+
+
+# Counts remember the tables they read, and a commit only drops the counts over
+# tables it wrote, so busy tables like job do not flush every asset count. Every
+# filter combination is its own key, so entries are capped and least recently
+# used counts go first.
+class CountCache:
+    def __init__(self, ttl: float, size: int) -> None:
+        self.ttl = ttl
+        self.size = size
+        self.generations: Counter[str] = Counter()
+        self.entries: OrderedDict[Hashable, tuple[float, int, frozenset[str]]] = (
+            OrderedDict()
+        )
+
+    @staticmethod
+    def key(stmt: Select, dialect: Dialect) -> Hashable:
+        compiled = stmt.order_by(None).compile(dialect=dialect)
+        return str(compiled), repr(sorted(compiled.params.items()))
+
+    @staticmethod
+    def tables(stmt: Select) -> frozenset[str]:
+        return frozenset(t.name for t in find_tables(stmt, include_joins=True))
+
+    def generation(self, tables: frozenset[str]) -> tuple[int, ...]:
+        return tuple(self.generations[t] for t in sorted(tables))
+
+    def get(self, key: Hashable) -> int | None:
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def prune(self, now: float) -> None:
+        expired = [k for k, e in self.entries.items() if now - e[0] > self.ttl]
+        for key in expired:
+            del self.entries[key]
+
+    def put(
+        self,
+        key: Hashable,
+        count: int,
+        tables: frozenset[str],
+        generation: tuple[int, ...],
+    ) -> None:
+        # Drop counts that raced with a commit, they may already be stale
+        if generation != self.generation(tables):
+            return
+
+        now = time.monotonic()
+        self.prune(now)
+        self.entries[key] = (now, count, tables)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, tables: set[str]) -> None:
+        self.generations.update(tables)
+        self.entries = OrderedDict(
+            (key, entry) for key, entry in self.entries.items() if not entry[2] & tables
+        )
+
+
+count_cache = CountCache(settings.count_cache_ttl, settings.count_cache_size)
+
+
+def _written(session: Session) -> set[str]:
+    return session.info.setdefault("counts_stale", set())
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_flushed(session: Session, flush_context: Any) -> None:
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        mapper = object_mapper(obj)
+        _written(session).update(t.name for t in mapper.tables)
+        # Collections flush into their association tables too
+        _written(session).update(
+            r.secondary.name for r in mapper.relationships if r.secondary is not None
+        )
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_executed(state: ORMExecuteState) -> None:
+    if state.is_insert or state.is_update or state.is_delete:
+        _written(state.session).add(state.statement.table.name)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_counts(session: Session) -> None:
+    if tables := session.info.pop("counts_stale", None):
+        count_cache.invalidate(tables)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_writes(session: Session) -> None:
+    session.info.pop("counts_stale", None)
+
+
 class Pagination(Protocol):
     offset: int
     limit: int
+    cursor: str | None
+
+
+def _entity(stmt: Select) -> Any:
+    return stmt.column_descriptions[0]["entity"]
+
+
+def _primary_key(entity: Any) -> str:
+    mapper = inspect(entity)
+    return mapper.get_property_by_column(mapper.primary_key[0]).key
+
+
+def _sort_key(stmt: Select) -> tuple[str, bool]:
+    # Set by the ORM ``sort`` helpers, the primary key breaks ties
+    default = (_primary_key(_entity(stmt)), True)
+    return stmt.get_execution_options().get("sort_key", default)
+
+
+def _sort_field(entity: Any, name: str) -> Any:
+    # Plain Python properties have no SQL to compare against
+    field = getattr(entity, name, None)
+    if not isinstance(field, ColumnElement) and not hasattr(
+        field, "__clause_element__"
+    ):
+        raise HTTPException(422, f"Cannot page by cursor when sorting by {name}")
+
+    return field
+
+
+def encode_cursor(stmt: Select, orm: Any) -> str:
+    name, ascending = _sort_key(stmt)
+    _sort_field(_entity(stmt), name)
+
+    value = getattr(orm, name)
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+
+    token = json.dumps([name, ascending, value, getattr(orm, _primary_key(type(orm)))])
+    return urlsafe_b64encode(token.encode()).decode()
+
+
+def seek(stmt: Select[tuple[T]], cursor: str) -> Select[tuple[T]]:
+    name, ascending = _sort_key(stmt)
+    entity = _entity(stmt)
+    field = _sort_field(entity, name)
+    try:
+        cursor_name, cursor_ascending, value, id = json.loads(urlsafe_b64decode(cursor))
+        if value is not None and isinstance(getattr(field, "type", None), DateTime):
+            value = datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(422, "Malformed cursor") from e
+
+    if (cursor_name, cursor_ascending) != (name, ascending):
+        raise HTTPException(422, "Cursor does not match the requested sort")
+
+    after = operator.gt if ascending else operator.lt
+    primary_key = getattr(entity, _primary_key(entity))
+    if name == _primary_key(entity):
+        return stmt.where(after(field, id))
+
+    # NULLs sort last, see ``ordered``
+    if value is None:
+        return stmt.where(field.is_(None), after(primary_key, id))
+    condition = after(tuple_(field, primary_key), tuple_(value, id))
+    if nullable(field):
+        condition = or_(condition, field.is_(None))
+    return stmt.where(condition)
+
+
+def paginate(stmt: Select[tuple[T]], pagination: Pagination | None) -> Select[tuple[T]]:
+    if pagination and pagination.cursor is not None:
+        if pagination.cursor:
+            stmt = seek(stmt, pagination.cursor)
+        stmt = stmt.limit(pagination.limit)
+    elif pagination:
+        stmt = stmt.offset(pagination.offset).limit(pagination.limit)
+
+    return stmt
 
 
 class DbProxy:
@@ -16,19 +230,23 @@ class DbProxy:
         self.session = session
 
     def count(self, stmt: Select) -> int:
-        return self.session.execute(select(func.count()).select_from(stmt)).scalar_one()
+        stmt = select(func.count()).select_from(stmt.order_by(None))
+        return self.session.execute(stmt).scalar_one()
 
     def all_or_paginated(
         self, stmt: Select[tuple[T]], pagination: Pagination | None
     ) -> Iterable[T]:
-        if pagination:
-            stmt = stmt.offset(pagination.offset).limit(pagination.limit)
+        return self.session.execute(paginate(stmt, pagination)).scalars().all()
 
+    def all(self, stmt: Select[tuple[T]]) -> Sequence[T]:
         return self.session.execute(stmt).scalars().all()
 
     def one(self, stmt: Select[tuple[T]]) -> T:
         return self.session.execute(stmt).scalar_one()
 
+    def one_or_none(self, stmt: Select[tuple[T]]) -> T | None:
+        return self.session.execute(stmt).scalar_one_or_none()
+
     def add(self, orm: Any) -> None:
         return self.session.add(orm)
 
@@ -37,3 +255,72 @@ class DbProxy:
 
     def commit(self) -> None:
         return self.session.commit()
+
+
+class AsyncDbProxy:
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+    async def count(self, stmt: Select) -> int:
+        stmt = select(func.count()).select_from(stmt.order_by(None))
+        res = await self.session.execute(stmt)
+        return res.scalar_one()
+
+    async def estimate(self, stmt: Select) -> int | None:
+        # Planner statistics only describe whole tables, so filters need exact counts
+        if (
+            stmt.whereclause is not None
+            or self.session.bind.dialect.name != "postgresql"
+        ):
+            return None
+
+        table = stmt.column_descriptions[0]["entity"].__table__
+        res = await self.session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:t)"),
+            {"t": table.name},
+        )
+        estimate = res.scalar_one_or_none()
+
+        # Tables that were never analyzed report -1
+        return None if estimate is None or estimate < 0 else estimate
+
+    async def total(self, stmt: Select, estimate: bool = False) -> Total:
+        if estimate and (count := await self.estimate(stmt)) is not None:
+            return Total(count, CountStrategy.ESTIMATE)
+
+        key = count_cache.key(stmt, self.session.bind.dialect)
+        if (count := count_cache.get(key)) is not None:
+            return Total(count, CountStrategy.CACHED)
+
+        tables = count_cache.tables(stmt)
+        generation = count_cache.generation(tables)
+        count = await self.count(stmt)
+        count_cache.put(key, count, tables, generation)
+        return Total(count, CountStrategy.EXACT)
+
+    async def all_or_paginated(
+        self, stmt: Select[tuple[T]], pagination: Pagination | None
+    ) -> Iterable[T]:
+        res = await self.session.execute(paginate(stmt, pagination))
+        return res.scalars().all()
+
+    async def all(self, stmt: Select[tuple[T]]) -> Sequence[T]:
+        res = await self.session.execute(stmt)
+        return res.scalars().all()
+
+    async def one(self, stmt: Select[tuple[T]]) -> T:
+        res = await self.session.execute(stmt)
+        return res.scalar_one()
+
+    async def one_or_none(self, stmt: Select[tuple[T]]) -> T | None:
+        res = await self.session.execute(stmt)
+        return res.scalar_one_or_none()
+
+    def add(self, orm: Any) -> None:
+        return self.session.add(orm)
+
+    async def delete(self, orm: Any) -> None:
+        return await self.session.delete(orm)
+
+    async def commit(self) -> None:
+        return await self.session.commit()
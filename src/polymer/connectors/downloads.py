@@ -0,0 +1,174 @@
+import asyncio
+import base64
+import hashlib
+import json
+import re
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO
+
+import httpx
+
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+HASH_BLOCK = 1 << 20
+
+
+class IncompleteDownload(RuntimeError):
+    pass
+
+
+@dataclass
+class DownloadResult:
+    filename: str
+    size: int
+    sha256: str
+    resumed_from: int = 0
+    elapsed: float = 0.0
+
+
+# Bytes land in <download_dir>/.partial/<slug>.part, with a JSON sidecar holding
+# what is needed to ask the server for the rest of the same representation.
+@dataclass
+class Partial:
+    root: Path
+    slug: str
+
+    @property
+    def part(self) -> Path:
+        return self.root / ".partial" / f"{self.slug}.part"
+
+    @property
+    def meta(self) -> Path:
+        return self.root / ".partial" / f"{self.slug}.json"
+
+    def resume_point(self) -> tuple[int, dict[str, Any]]:
+        try:
+            meta = json.loads(self.meta.read_text())
+            return self.part.stat().st_size, meta
+        except (OSError, ValueError):
+            return 0, {}
+
+    def save(self, meta: dict[str, Any]) -> None:
+        self.meta.parent.mkdir(parents=True, exist_ok=True)
+        self.meta.write_text(json.dumps(meta))
+
+    def discard(self) -> None:
+        self.part.unlink(missing_ok=True)
+        self.meta.unlink(missing_ok=True)
+
+
+def range_headers(offset: int, meta: dict[str, Any]) -> dict[str, str]:
+    # Plain identity bytes, otherwise offsets would not line up across requests
+    headers = {"Accept-Encoding": "identity"}
+    if offset and meta.get("validator"):
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = meta["validator"]
+    return headers
+
+
+def validator(response: httpx.Response) -> str | None:
+    # If-Range only accepts strong validators
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+# Offset the body starts at, and the full length when the server says
+def content_span(response: httpx.Response) -> tuple[int, int | None]:
+    if response.status_code == 206:
+        match = CONTENT_RANGE.fullmatch(response.headers.get("Content-Range", ""))
+        if match is None:
+            raise IncompleteDownload(f"Unusable Content-Range from {response.url}")
+        start, _, total = match.groups()
+        return int(start), None if total == "*" else int(total)
+
+    length = response.headers.get("Content-Length")
+    return 0, None if length is None else int(length)
+
+
+def expected_sha256(response: httpx.Response) -> str | None:
+    if value := response.headers.get("x-amz-checksum-sha256"):
+        return base64.b64decode(value).hex()
+
+    for header in ("Repr-Digest", "Digest"):
+        for part in response.headers.get(header, "").split(","):
+            algorithm, _, value = part.strip().partition("=")
+            if algorithm.lower() == "sha-256" and value:
+                return base64.b64decode(value.strip(":")).hex()
+
+    return None
+
+
+# Buffers chunks into blocks written by a worker thread, with at most one write
+# in flight, so memory stays under two blocks and the event loop never blocks.
+class AsyncFileWriter:
+    def __init__(self, file: BinaryIO, hasher: Any, block_size: int) -> None:
+        self.file = file
+        self.hasher = hasher
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.pending: asyncio.Future | None = None
+
+    def _write(self, block: bytes) -> None:
+        self.file.write(block)
+        self.hasher.update(block)
+
+    async def _submit(self) -> None:
+        if self.pending is not None:
+            await self.pending
+        block, self.buffer = bytes(self.buffer), bytearray()
+        self.pending = asyncio.ensure_future(asyncio.to_thread(self._write, block))
+
+    async def write(self, chunk: bytes) -> None:
+        self.buffer += chunk
+        if len(self.buffer) >= self.block_size:
+            await self._submit()
+
+    async def drain(self) -> None:
+        if self.buffer:
+            await self._submit()
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            await pending
+
+
+@asynccontextmanager
+async def file_writer(
+    path: Path, offset: int, hasher: Any, block_size: int
+) -> AsyncIterator[AsyncFileWriter]:
+    def _open() -> BinaryIO:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        f = path.open("r+b" if offset else "wb")
+        f.seek(offset)
+        f.truncate()
+        return f
+
+    f = await asyncio.to_thread(_open)
+    writer = AsyncFileWriter(f, hasher, block_size)
+    try:
+        yield writer
+    finally:
+        # Flushed on errors too, whatever arrived is kept for resuming
+        try:
+            await writer.drain()
+        finally:
+            await asyncio.to_thread(f.close)
+
+
+def hash_file(path: Path, hasher: Any, limit: int | None = None) -> Any:
+    with path.open("rb") as f:
+        while limit is None or limit > 0:
+            block = f.read(HASH_BLOCK if limit is None else min(HASH_BLOCK, limit))
+            if not block:
+                break
+            hasher.update(block)
+            if limit is not None:
+                limit -= len(block)
+    return hasher
+
+
+def file_sha256(path: Path) -> str:
+    return hash_file(path, hashlib.sha256()).hexdigest()
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from collections.abc import Iterable
+
+from sqlalchemy import Engine, Table, event, select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..orms import Tag, User
+
+caches: list["IdentityCache"] = []
+
+
+# Bounded LRU of natural key -> id. Ids learnt inside a transaction stay private
+# to that session until it commits, so a rollback never caches vanished rows.
+class IdentityCache:
+    def __init__(self, table: Table, column: str, maxsize: int) -> None:
+        self.table = table
+        self.column = column
+        self.maxsize = maxsize
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        caches.append(self)
+
+    @property
+    def name(self) -> str:
+        return f"{self.table.name}.{self.column}"
+
+    def _pending(self, session: Session) -> dict[str, int]:
+        return session.info.setdefault(("identity", self.name), {})
+
+    def get_many(
+        self, session: Session, keys: Iterable[str]
+    ) -> tuple[dict[str, int], set[str]]:
+        pending = self._pending(session)
+        found: dict[str, int] = {}
+        missing: set[str] = set()
+
+        for key in keys:
+            if key in pending:
+                found[key] = pending[key]
+            elif key in self.entries:
+                self.entries.move_to_end(key)
+                found[key] = self.entries[key]
+            else:
+                missing.add(key)
+
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found, missing
+
+    def put(self, session: Session, ids: dict[str, int]) -> None:
+        self._pending(session).update(ids)
+
+    def _store(self, ids: dict[str, int]) -> None:
+        for key, id in ids.items():
+            self.entries[key] = id
+            self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def commit(self, session: Session) -> None:
+        self._store(session.info.pop(("identity", self.name), {}))
+
+    def rollback(self, session: Session) -> None:
+        session.info.pop(("identity", self.name), None)
+
+    def warm(self, engine: Engine) -> None:
+        key, id = self.table.c[self.column], self.table.c.id
+        with engine.connect() as conn:
+            rows = conn.execute(select(key, id).order_by(id.desc()).limit(self.maxsize))
+            self._store(dict(rows.tuples().all()))
+
+
+@event.listens_for(Session, "after_commit")
+def _promote_pending(session: Session) -> None:
+    for cache in caches:
+        cache.commit(session)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    for cache in caches:
+        cache.rollback(session)
+
+
+tag_ids = IdentityCache(Tag.__table__, "label", settings.identity_cache_size)
+user_ids = IdentityCache(User.__table__, "nickname", settings.identity_cache_size)
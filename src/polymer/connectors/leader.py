@@ -0,0 +1,143 @@
+import asyncio
+import datetime
+import fcntl
+import os
+import socket
+from logging import getLogger
+from pathlib import Path
+from typing import IO
+
+from sqlalchemy import Connection, Engine, text
+
+from ..config import settings
+
+logger = getLogger(__name__)
+
+# "polymer" in ASCII, the advisory lock every replica contends for
+LOCK_KEY = 0x706F6C796D6572
+
+
+# Exactly one process holds the lock and runs scheduled work. Postgres uses a
+# session advisory lock on a dedicated connection, SQLite an flock next to the
+# database file; both are released by the server or kernel when the holder dies.
+class LeaderElection:
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+        self.id = f"{socket.gethostname()}:{os.getpid()}"
+        self.is_leader = False
+        self.since: datetime.datetime | None = None
+        self.connection: Connection | None = None
+        self.file: IO | None = None
+
+    @property
+    def backend(self) -> str:
+        if self.engine.dialect.name == "postgresql":
+            return "advisory-lock"
+        return "file-lock"
+
+    def lock_path(self) -> Path:
+        if database := self.engine.url.database:
+            if database != ":memory:":
+                return Path(f"{database}.leader")
+        return Path(settings.download_dir, ".leader")
+
+    def _try_advisory(self) -> bool:
+        if self.connection is None:
+            self.connection = self.engine.connect()
+        try:
+            locked = self.connection.scalar(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": LOCK_KEY}
+            )
+            self.connection.commit()
+        except Exception:
+            self._close()
+            raise
+        return bool(locked)
+
+    def _try_flock(self) -> bool:
+        if self.file is None:
+            self.file = self.lock_path().open("a+")
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+
+        self.file.truncate(0)
+        self.file.write(self.id)
+        self.file.flush()
+        return True
+
+    def try_acquire(self) -> bool:
+        if self.backend == "advisory-lock":
+            acquired = self._try_advisory()
+        else:
+            acquired = self._try_flock()
+
+        if acquired:
+            self.is_leader = True
+            self.since = datetime.datetime.utcnow()
+            logger.info(f"{self.id} is now the leader ({self.backend})")
+        return acquired
+
+    def still_leader(self) -> bool:
+        if self.backend == "file-lock":
+            return self.file is not None and not self.file.closed
+
+        # A dropped connection takes the lock with it
+        try:
+            held = self.connection.scalar(
+                text(
+                    "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' "
+                    "AND classid::bigint = :high AND objid::bigint = :low "
+                    "AND objsubid = 1 AND pid = pg_backend_pid() AND granted"
+                ),
+                {"high": LOCK_KEY >> 32, "low": LOCK_KEY & 0xFFFFFFFF},
+            )
+            self.connection.commit()
+        except Exception:
+            logger.exception("Leader heartbeat failed")
+            return False
+        return bool(held)
+
+    def holder(self) -> str | None:
+        if self.backend == "file-lock":
+            try:
+                return self.lock_path().read_text() or None
+            except FileNotFoundError:
+                return None
+
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                text(
+                    "SELECT a.client_addr, a.pid FROM pg_locks l "
+                    "JOIN pg_stat_activity a ON a.pid = l.pid "
+                    "WHERE l.locktype = 'advisory' AND l.classid::bigint = :high "
+                    "AND l.objid::bigint = :low AND l.objsubid = 1 AND l.granted"
+                ),
+                {"high": LOCK_KEY >> 32, "low": LOCK_KEY & 0xFFFFFFFF},
+            ).first()
+        # Only the connection is visible to Postgres, not the process behind it
+        return None if row is None else f"{row.client_addr} (backend {row.pid})"
+
+    async def lost(self) -> None:
+        while True:
+            await asyncio.sleep(settings.leader_heartbeat_interval)
+            if not await asyncio.to_thread(self.still_leader):
+                logger.error(f"{self.id} lost leadership")
+                return
+
+    def _close(self) -> None:
+        if self.connection is not None:
+            # Never back into the pool, where the session lock would live on
+            self.connection.invalidate()
+            self.connection.close()
+            self.connection = None
+
+    def release(self) -> None:
+        self.is_leader = False
+        self.since = None
+        # Closing the connection or file drops the lock with it
+        self._close()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
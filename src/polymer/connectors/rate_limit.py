@@ -0,0 +1,175 @@
+import asyncio
+import datetime
+import random
+import time
+from email.utils import parsedate_to_datetime
+from itertools import count
+from logging import getLogger
+
+import httpx
+
+from ..config import settings
+
+logger = getLogger(__name__)
+
+limiters: dict[str, "HostLimiter"] = {}
+
+# The server refused these without doing the work, so any method may resend
+THROTTLED = {429, 503}
+SERVER_ERRORS = {500, 502, 504}
+IDEMPOTENT = {"GET", "HEAD", "OPTIONS"}
+
+
+# Token bucket whose refill rate follows AIMD: it creeps up while requests are
+# fast and succeed, and halves on throttling, server errors and slow responses.
+class HostLimiter:
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self.rate = settings.rate_limit_rate
+        self.min_rate = settings.rate_limit_min
+        self.max_rate = settings.rate_limit_max
+        self.burst = settings.rate_limit_burst
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.errors = 0
+        self.latency: float | None = None
+
+    def available(self, now: float | None = None) -> float:
+        elapsed = (now or time.monotonic()) - self.updated
+        return min(self.burst, self.tokens + elapsed * self.rate)
+
+    def paused_for(self) -> float:
+        return max(self.paused_until - time.monotonic(), 0.0)
+
+    def _refill(self, now: float) -> None:
+        self.tokens = self.available(now)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        # Held while sleeping so waiters are served in arrival order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                elif self.tokens < 1:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                else:
+                    self.tokens -= 1
+                    self.requests += 1
+                    return
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _decrease(self) -> None:
+        self.rate = max(self.min_rate, self.rate * settings.rate_limit_decrease)
+
+    def success(self, latency: float) -> None:
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += 0.2 * (latency - self.latency)
+
+        if latency > settings.http_slow_seconds:
+            self._decrease()
+        else:
+            self.rate = min(self.max_rate, self.rate + settings.rate_limit_increase)
+
+    def failure(self, status: int | None) -> None:
+        if status in THROTTLED:
+            self.throttled += 1
+        else:
+            self.errors += 1
+        self._decrease()
+
+
+def limiter_for(host: str) -> HostLimiter:
+    if host not in limiters:
+        limiters[host] = HostLimiter(host)
+    return limiters[host]
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((when - datetime.datetime.now(datetime.UTC)).total_seconds(), 0.0)
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter, so retries from concurrent tasks spread out
+    ceiling = min(settings.http_backoff_max, settings.http_backoff_base * 2**attempt)
+    return random.uniform(0, ceiling)
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport | None = None) -> None:
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        limiter = limiter_for(request.url.host)
+        # Non-idempotent requests can opt in with extensions={"retry": True}
+        retry_errors = request.method in IDEMPOTENT or request.extensions.get("retry")
+
+        for attempt in count():
+            await limiter.acquire()
+            last = attempt == settings.http_retries
+            start = time.monotonic()
+
+            try:
+                response = await self.transport.handle_async_request(request)
+            except (httpx.TimeoutException, httpx.NetworkError) as e:
+                limiter.failure(None)
+                if last or not retry_errors:
+                    raise
+
+                delay = _backoff(attempt)
+                logger.warning(f"{e!r} from {request.url.host}, retry in {delay:.1f}s")
+                limiter.retries += 1
+                await asyncio.sleep(delay)
+                continue
+
+            status = response.status_code
+            if status in THROTTLED or (retry_errors and status in SERVER_ERRORS):
+                limiter.failure(status)
+                if last:
+                    return response
+
+                delay = _retry_after(response)
+                if delay is not None:
+                    limiter.pause(delay)
+                else:
+                    delay = _backoff(attempt)
+
+                await response.aclose()
+                logger.warning(
+                    f"{status} from {request.url.host}, retry in {delay:.1f}s"
+                )
+                limiter.retries += 1
+                await asyncio.sleep(delay)
+                continue
+
+            limiter.success(time.monotonic() - start)
+            return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
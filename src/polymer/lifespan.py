@@ -1,10 +1,12 @@
 import asyncio
+import datetime
 import time
 from asyncio import Queue, Task, create_task
-from collections.abc import Callable
+from collections.abc import AsyncIterator, Callable
 from contextlib import asynccontextmanager
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from logging import getLogger
+from typing import Any, NoReturn
 
 import aiocron
 import httpx
@@ -13,13 +15,23 @@ from sqlalchemy.orm import Session
 
 from alembic import command
 from alembic.config import Config
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
 from polymer.connectors.cults_client import CultsGraphQLClient
 
 from .components.actor import Actor
-from .components.ingester import Ingester
+from .components.deduper import Deduper
+from .components.ingester import DOWNLOAD_URL_SET, NEW_FREE_ASSET, Ingester
+from .components.job_queue import JobQueue
 from .components.scraper import Scraper
+from .components.task_history import RollingStats, TaskHistory
+from .config import settings
+from .connectors.blobs import blob_store
 from .connectors.cults_client import CultsClient, CultsGraphQLClient
-from .orms import engine
+from .connectors.identity import caches
+from .connectors.leader import LeaderElection
+from .connectors.rate_limit import RateLimitedTransport
+from .orms import TaskOutcome, async_engine, engine
 
 logger = getLogger(__name__)
 
@@ -29,18 +41,59 @@ class TaskSpec:
     callable: Callable
     cron: str
     startup: bool
+    events: tuple[str, ...] = ()
+    debounce: float = 0.0
     last_run_at: float | None = None
     last_duration: float | None = None
+    pending: asyncio.TimerHandle | None = None
+    rerun: bool = False
+    stats: RollingStats = field(
+        default_factory=lambda: RollingStats(settings.task_run_window)
+    )
+
+    @property
+    def name(self) -> str:
+        return self.callable.__qualname__
 
 
 class TaskManager:
     def __init__(self) -> None:
         self.specs: list[TaskSpec] = []
         self.crons = set()
-        self.tasks: set[Callable] = set()
+        self.tasks: dict[Callable, Task] = {}
+        # Drained into task_run in batches by TaskHistory
+        self.runs: list[dict[str, Any]] = []
+
+    def _record(
+        self,
+        spec: TaskSpec,
+        started_at: datetime.datetime,
+        outcome: TaskOutcome,
+        duration: float | None = None,
+        error: str | None = None,
+        items: int | None = None,
+    ) -> None:
+        spec.stats.add(outcome, duration)
+        self.runs.append(
+            {
+                "name": spec.name,
+                "started_at": started_at,
+                "duration": duration,
+                "outcome": outcome,
+                "error": error,
+                "items": items,
+            }
+        )
 
-    def register(self, callable: Callable, cron: str, startup: bool = False) -> None:
-        self.specs.append(TaskSpec(callable, cron, startup))
+    def register(
+        self,
+        callable: Callable,
+        cron: str,
+        startup: bool = False,
+        events: tuple[str, ...] = (),
+        debounce: float = 1.0,
+    ) -> None:
+        self.specs.append(TaskSpec(callable, cron, startup, events, debounce))
 
     def startup(self) -> None:
         for spec in self.specs:
@@ -49,60 +102,226 @@ class TaskManager:
 
             self.crons.add(aiocron.crontab(spec.cron, self._start_task, (spec,)))
 
+    def shutdown(self) -> list[Task]:
+        for cron in self.crons:
+            cron.stop()
+        self.crons.clear()
+
+        for spec in self.specs:
+            if spec.pending is not None:
+                spec.pending.cancel()
+            spec.rerun = False
+        self.specs = []
+
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        return tasks
+
+    def emit(self, event: str) -> None:
+        for spec in self.specs:
+            if event not in spec.events or spec.pending is not None:
+                continue
+
+            # Everything emitted inside the window coalesces into one run
+            loop = asyncio.get_running_loop()
+            spec.pending = loop.call_later(spec.debounce, self._triggered, spec)
+
+    def _triggered(self, spec: TaskSpec) -> None:
+        spec.pending = None
+        if spec.callable in self.tasks:
+            # The running pass may have read the table before the change
+            spec.rerun = True
+        else:
+            self._start_task(spec)
+
     def _start_task(self, spec: TaskSpec) -> Task:
+        started_at = datetime.datetime.utcnow()
         if spec.callable in self.tasks:
-            logger.warning(f"Skipping {spec.callable.__qualname__}, double scheduled")
+            logger.warning(f"Skipping {spec.name}, double scheduled")
+            self._record(spec, started_at, TaskOutcome.SKIPPED)
             return
 
-        self.tasks.add(spec.callable)
         task = create_task(spec.callable())
+        self.tasks[spec.callable] = task
         spec.last_run_at = time.time()
 
         def _done_callback(task: Task) -> None:
             spec.last_duration = time.time() - spec.last_run_at
-            logger.info(f"Ran {spec.callable.__qualname__} in {spec.last_duration}")
-            self.tasks.discard(spec.callable)
+            logger.info(f"Ran {spec.name} in {spec.last_duration}")
+            self.tasks.pop(spec.callable, None)
+
+            if task.cancelled():
+                self._record(
+                    spec, started_at, TaskOutcome.CANCELLED, spec.last_duration
+                )
+            elif (e := task.exception()) is not None:
+                logger.error(f"Exception in task {spec.name}", exc_info=e)
+                self._record(
+                    spec, started_at, TaskOutcome.FAILED, spec.last_duration, repr(e)
+                )
+            else:
+                # Tasks that return a count have it recorded as items
+                result = task.result()
+                items = result if isinstance(result, int) else None
+                self._record(
+                    spec, started_at, TaskOutcome.OK, spec.last_duration, items=items
+                )
+
+            if spec.rerun:
+                spec.rerun = False
+                self._start_task(spec)
 
         task.add_done_callback(_done_callback)
         return task
 
 
 manager = TaskManager()
+election = LeaderElection(engine)
 minutely = "* * * * *"
+hourly = "0 * * * *"
+daily = "0 4 * * *"
+
+
+def at_head() -> bool:
+    head = ScriptDirectory.from_config(Config("./alembic.ini")).get_current_head()
+    with engine.connect() as connection:
+        return MigrationContext.configure(connection).get_current_revision() == head
 
 
 @asynccontextmanager
-async def lifespan(app: FastAPI) -> None:
+async def leader_duties() -> AsyncIterator[None]:
     config = Config("./alembic.ini")
-    command.upgrade(config, "head", tag="skip_log_config")
+    await asyncio.to_thread(command.upgrade, config, "head", tag="skip_log_config")
 
-    def handler(loop, context):
-        logger.error(
-            f"Exception in task {context['future']}", exc_info=context["exception"]
-        )
-        loop.default_exception_handler(context)
+    for cache in caches:
+        cache.warm(engine)
 
-    asyncio.get_event_loop().set_exception_handler(handler)
-
-    queue = Queue()
+    queue = Queue(settings.ingest_queue_size)
 
-    with Session(engine) as ingester_session, Session(engine) as actor_session:
-        async with httpx.AsyncClient() as http_client, httpx.AsyncClient() as http_client_2:
+    with (
+        Session(engine) as ingester_session,
+        Session(engine) as actor_session,
+        Session(engine) as scraper_session,
+        Session(engine) as deduper_session,
+        Session(engine) as history_session,
+    ):
+        async with (
+            httpx.AsyncClient(
+                transport=RateLimitedTransport(), timeout=settings.http_timeout
+            ) as http_client,
+            httpx.AsyncClient(
+                transport=RateLimitedTransport(), timeout=settings.http_timeout
+            ) as http_client_2,
+        ):
             client = CultsClient(http_client)
             client_ql = CultsGraphQLClient(http_client_2)
 
-            scraper = Scraper(client_ql, queue)
-            ingester = Ingester(ingester_session, queue)
-            actor = Actor(client, actor_session)
+            scraper = Scraper(client_ql, scraper_session, queue)
+            ingester = Ingester(ingester_session, queue, emit=manager.emit)
+            actor = Actor(client, actor_session, JobQueue(actor_session))
+            deduper = Deduper(deduper_session, blob_store)
+            history = TaskHistory(history_session, manager)
 
             manager.register(scraper.fetch_liked, minutely, startup=True)
             manager.register(scraper.fetch_orders, minutely)
-            manager.register(actor.order_liked_free, minutely)
-            manager.register(actor.download_orders, minutely)
+            manager.register(scraper.reconcile_liked, hourly)
+            manager.register(scraper.reconcile_orders, hourly)
+            # Cron only backs up the ingester's events
+            manager.register(
+                actor.enqueue,
+                hourly,
+                startup=True,
+                events=(NEW_FREE_ASSET, DOWNLOAD_URL_SET),
+            )
+            manager.register(deduper.run, daily, startup=True)
+            manager.register(history.prune, daily)
 
+            history.warm()
+            history_task = create_task(history.run())
             ingester_task = create_task(ingester.run())
+            workers = [create_task(actor.work(n)) for n in range(settings.job_workers)]
             manager.startup()
 
-            yield
+            try:
+                yield
+            finally:
+                running = manager.shutdown()
+                ingester_task.cancel()
+                for worker in workers:
+                    worker.cancel()
+                history_task.cancel()
+                await asyncio.gather(
+                    ingester_task,
+                    history_task,
+                    *workers,
+                    *running,
+                    return_exceptions=True,
+                )
+                history.flush()
+
+
+async def lead(ready: asyncio.Event) -> NoReturn:
+    # Followers only serve the API, and keep trying in case the leader dies
+    while True:
+        try:
+            acquired = await asyncio.to_thread(election.try_acquire)
+        except Exception:
+            logger.exception("Leader election failed, retrying")
+            acquired = False
+
+        if not acquired:
+            # Only the leader migrates, so wait for it before serving
+            if not ready.is_set():
+                try:
+                    migrated = await asyncio.to_thread(at_head)
+                except Exception:
+                    logger.exception("Could not read the schema revision, retrying")
+                    migrated = False
+
+                if migrated:
+                    logger.info(f"{election.id} is a follower, serving the API only")
+                    ready.set()
+                else:
+                    logger.info(f"{election.id} is waiting for migrations")
+            await asyncio.sleep(settings.leader_poll_interval)
+            continue
+
+        try:
+            async with leader_duties():
+                ready.set()
+                await election.lost()
+        except Exception:
+            logger.exception("Leader duties failed, stepping down")
+        finally:
+            # Only once scheduled work has stopped, so leaders never overlap
+            election.release()
+
+        await asyncio.sleep(settings.leader_poll_interval)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> None:
+    def handler(loop, context):
+        logger.error(
+            f"Exception in task {context['future']}", exc_info=context["exception"]
+        )
+        loop.default_exception_handler(context)
+
+    asyncio.get_event_loop().set_exception_handler(handler)
+
+    # Nothing is served until the schema is at head
+    ready = asyncio.Event()
+    leader_task = create_task(lead(ready))
+    await ready.wait()
+
+    yield
+
+    leader_task.cancel()
+    try:
+        await leader_task
+    except asyncio.CancelledError:
+        pass
+    election.release()
 
-            ingester_task.cancel()
+    await async_engine.dispose()
@@ -53,9 +53,19 @@ class DownloadModel(BaseModel):
     id: int
     asset_id: int
     filename: str
+    size: int | None
+    sha256: str | None
     downloaded_at: datetime.datetime
 
 
+class BundleEntryModel(BaseModel):
+    id: int
+    asset_id: int
+    path: str
+    size: int | None
+    sha256: str | None
+
+
 class TagModel(BaseModel):
     id: int
     label: str
@@ -72,8 +82,15 @@ class TaskModel(BaseModel):
     name: str
     cron: str
     startup: bool
+    events: list[str]
     last_run_at: datetime.datetime | None
     last_duration: float | None
+    runs: int
+    p50: float | None
+    p95: float | None
+    p99: float | None
+    failure_rate: float | None
+    skipped: int
 
     @computed_field
     @cached_property
@@ -85,6 +102,27 @@ class TaskModel(BaseModel):
         return str(request.url_for("task_run", id=self.id))
 
 
+class LeaderModel(BaseModel):
+    id: str
+    leader: bool
+    since: datetime.datetime | None
+    backend: str
+
+
+class CacheModel(BaseModel):
+    id: str = Field(validation_alias="name")
+    size: int
+    maxsize: int
+    hits: int
+    misses: int
+
+    @computed_field
+    @cached_property
+    def hit_rate(self) -> float | None:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+
 class CategoryCreate(BaseModel):
     parent_id: int | None = None
     label: str
@@ -104,4 +142,58 @@ class MmfModel(BaseModel):
     refresh_exp: datetime.datetime
 
 class CultsModel(BaseModel):
-    email: str
\ No newline at end of file
+    email: str
+    logged_in_at: datetime.datetime | None = None
+    checked_at: datetime.datetime | None = None
+
+
+class LimitModel(BaseModel):
+    id: str = Field(validation_alias="host")
+    rate: float
+    min_rate: float
+    max_rate: float
+    tokens: float
+    requests: int
+    retries: int
+    throttled: int
+    errors: int
+    latency: float | None
+    paused_for: float
+
+
+class ActorModel(BaseModel):
+    concurrency: int
+    min_concurrency: int
+    max_concurrency: int
+    in_flight: int
+    bytes_per_second: float | None
+    bandwidth_cap: float | None
+    latency: float | None
+    bytes: int
+    completed: int
+    errors: int
+    queue_latency_p50: float | None
+    queue_latency_p95: float | None
+
+
+class JobModel(BaseModel):
+    id: int
+    kind: str
+    asset_id: int
+    priority: int
+    attempts: int
+    available_at: datetime.datetime
+    leased_until: datetime.datetime | None
+    leased_by: str | None
+    finished_at: datetime.datetime | None
+    failed_at: datetime.datetime | None
+    error: str | None
+
+
+class SyncModel(BaseModel):
+    id: str = Field(validation_alias="name")
+    watermark: str | None
+    synced_at: datetime.datetime | None
+    reconciled_at: datetime.datetime | None
+    requests: int
+    bytes: int
@@ -1,8 +1,12 @@
-from ._base import Base, engine
+from ._base import Base, async_engine, engine
 from .asset import Asset
 from .category import Category
+from .cults_login import CultsLogin
 from .download import Download
 from .illustration import Illustration
 from .tag import Tag
 from .user import User
-from .mmf import Mmf
\ No newline at end of file
+from .mmf import Mmf
+from .sync_state import SyncState
+from .job import Job, JobKind
+from .task_run import TaskOutcome, TaskRun
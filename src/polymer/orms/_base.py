@@ -1,8 +1,21 @@
-from sqlalchemy import Column, ForeignKey, Table, create_engine
+from typing import Any
+
+from sqlalchemy import (
+    URL,
+    Column,
+    ColumnElement,
+    ForeignKey,
+    Table,
+    create_engine,
+    make_url,
+)
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import DeclarativeBase
 
 from ..config import settings
 
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
 
 class Base(DeclarativeBase):
     pass
@@ -11,9 +24,27 @@ class Base(DeclarativeBase):
 tag_association_table = Table(
     "tag_association_table",
     Base.metadata,
-    Column("asset_id", ForeignKey("asset.id")),
-    Column("tag_id", ForeignKey("tag.id")),
+    Column("asset_id", ForeignKey("asset.id"), primary_key=True),
+    Column("tag_id", ForeignKey("tag.id"), primary_key=True, index=True),
 )
 
 
+def nullable(field: Any) -> bool:
+    # Hybrid expressions such as ``free`` are built from non-null columns
+    return bool(getattr(getattr(field, "expression", field), "nullable", False))
+
+
+def ordered(field: Any, ascending: bool) -> ColumnElement:
+    # NULLs go last both ways, which is where cursor seeking expects them
+    order = field.asc() if ascending else field.desc()
+    return order.nulls_last() if nullable(field) else order
+
+
+def _async_url(db_url: str) -> URL:
+    url = make_url(db_url)
+    backend = url.get_backend_name()
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
 engine = create_engine(settings.db_url)
+async_engine = create_async_engine(_async_url(settings.db_url))
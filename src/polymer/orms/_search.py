@@ -0,0 +1,100 @@
+from typing import Any
+
+from sqlalchemy import DDL, Boolean, Float, String, TypeDecorator, event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.functions import FunctionElement
+
+from ._base import Base
+
+# Both take (id, *document columns, query). Postgres matches against a GIN
+# expression index over the concatenated columns, SQLite against an external
+# content FTS5 table named "<table>_fts" kept in sync by triggers.
+
+
+class SearchQuery(TypeDecorator):
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value: str | None, dialect: Any) -> str | None:
+        if value is None or dialect.name != "sqlite":
+            return value
+
+        # FTS5 treats punctuation as query syntax, so match each term as a quoted prefix
+        return " ".join(
+            '"{}"*'.format(term.replace('"', '""')) for term in value.split()
+        )
+
+
+class search_match(FunctionElement):
+    type = Boolean()
+    inherit_cache = True
+
+
+class search_rank(FunctionElement):
+    type = Float()
+    inherit_cache = True
+
+
+def _parts(
+    element: FunctionElement, compiler: SQLCompiler, **kw: Any
+) -> tuple[str, str, str, str]:
+    id, *columns, query = element.clauses.clauses
+    document = " || ' ' || ".join(compiler.process(c, **kw) for c in columns)
+    return (
+        compiler.process(id, **kw),
+        f"to_tsvector('english', {document})",
+        compiler.process(query, **kw),
+        f"{id.table.name}_fts",
+    )
+
+
+@compiles(search_match, "postgresql")
+def _match_postgresql(element: search_match, compiler: SQLCompiler, **kw: Any) -> str:
+    _, document, query, _ = _parts(element, compiler, **kw)
+    return f"{document} @@ websearch_to_tsquery('english', {query})"
+
+
+@compiles(search_rank, "postgresql")
+def _rank_postgresql(element: search_rank, compiler: SQLCompiler, **kw: Any) -> str:
+    _, document, query, _ = _parts(element, compiler, **kw)
+    return f"ts_rank({document}, websearch_to_tsquery('english', {query}))"
+
+
+@compiles(search_match, "sqlite")
+def _match_sqlite(element: search_match, compiler: SQLCompiler, **kw: Any) -> str:
+    id, _, query, fts = _parts(element, compiler, **kw)
+    return f"{id} IN (SELECT rowid FROM {fts} WHERE {fts} MATCH {query})"
+
+
+@compiles(search_rank, "sqlite")
+def _rank_sqlite(element: search_rank, compiler: SQLCompiler, **kw: Any) -> str:
+    id, _, query, fts = _parts(element, compiler, **kw)
+    # bm25 is negative, lower is better
+    return (
+        f"(SELECT -bm25({fts}) FROM {fts} WHERE {fts} MATCH {query} AND rowid = {id})"
+    )
+
+
+# Mirrors the search index migration so create_all() databases can search too
+for ddl in (
+    "CREATE VIRTUAL TABLE asset_fts USING fts5("
+    "slug, name, description, details, content='asset', content_rowid='id')",
+    "CREATE TRIGGER asset_fts_ai AFTER INSERT ON asset BEGIN "
+    "INSERT INTO asset_fts(rowid, slug, name, description, details) "
+    "VALUES (new.id, new.slug, new.name, new.description, new.details); END",
+    "CREATE TRIGGER asset_fts_ad AFTER DELETE ON asset BEGIN "
+    "INSERT INTO asset_fts(asset_fts, rowid, slug, name, description, details) "
+    "VALUES ('delete', old.id, old.slug, old.name, old.description, old.details); END",
+    "CREATE TRIGGER asset_fts_au AFTER UPDATE ON asset BEGIN "
+    "INSERT INTO asset_fts(asset_fts, rowid, slug, name, description, details) "
+    "VALUES ('delete', old.id, old.slug, old.name, old.description, old.details); "
+    "INSERT INTO asset_fts(rowid, slug, name, description, details) "
+    "VALUES (new.id, new.slug, new.name, new.description, new.details); END",
+):
+    event.listen(Base.metadata, "after_create", DDL(ddl).execute_if(dialect="sqlite"))
+event.listen(
+    Base.metadata,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS asset_fts").execute_if(dialect="sqlite"),
+)
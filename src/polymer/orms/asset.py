@@ -7,15 +7,24 @@ from sqlalchemy import (
     ColumnElement,
     ForeignKey,
     Select,
+    literal,
     or_,
     select,
     type_coerce,
 )
 from sqlalchemy.ext.associationproxy import AssociationProxy, association_proxy
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import (
+    Mapped,
+    joinedload,
+    mapped_column,
+    relationship,
+    selectinload,
+)
+from sqlalchemy.sql.base import ExecutableOption
 
-from ._base import Base, tag_association_table
+from ._base import Base, ordered, tag_association_table
+from ._search import SearchQuery, search_match, search_rank
 
 if TYPE_CHECKING:
     from .download import Download
@@ -51,13 +60,14 @@ class Asset(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str]
-    creator_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
+    creator_id: Mapped[int] = mapped_column(ForeignKey("user.id"), index=True)
     details: Mapped[str]
     description: Mapped[str]
-    slug: Mapped[str]
+    slug: Mapped[str] = mapped_column(unique=True, index=True)
     cents: Mapped[int]
     download_url: Mapped[str | None]
     yanked: Mapped[bool]
+    fingerprint: Mapped[str | None]
 
     downloads: Mapped[list["Download"]] = relationship(
         back_populates="asset", cascade="all, delete-orphan"
@@ -115,21 +125,16 @@ class Asset(Base):
         if search.creator_id is not None:
             stmt = stmt.where(cls.creator_id == search.creator_id)
 
-        if search.q is not None:
-            from .user import User
-
+        if search.q is not None and search.q.strip():
+            # Slug and nickname matches keep partial words working, both are
+            # backed by trigram indexes on Postgres
             stmt = stmt.where(
                 or_(
-                    *(
-                        f.icontains(search.q)
-                        for f in (
-                            cls.slug,
-                            cls.name,
-                            cls.description,
-                            cls.details,
-                        )
+                    search_match(*cls._document(search.q)),
+                    cls.slug.icontains(search.q),
+                    cls.creator_id.in_(
+                        select(User.id).where(User.nickname.icontains(search.q))
                     ),
-                    cls.creator.has(User.nickname.icontains(search.q)),
                 )
             )
 
@@ -138,21 +143,51 @@ class Asset(Base):
 
         return stmt
 
+    @classmethod
+    def _document(cls, q: str) -> tuple[ColumnElement, ...]:
+        return (
+            cls.id,
+            cls.slug,
+            cls.name,
+            cls.description,
+            cls.details,
+            literal(q, SearchQuery()),
+        )
+
+    @classmethod
+    def rank(cls, stmt: Select[T], search: AssetSearch) -> Select[T]:
+        if search.q is None or not search.q.strip():
+            raise HTTPException(422, "Sorting by relevance requires q")
+
+        return stmt.order_by(
+            search_rank(*cls._document(search.q)).desc(), cls.id.asc()
+        ).execution_options(sort_key=("relevance", False))
+
     @classmethod
     def sort(cls, stmt: Select[T], sort: AssetSort) -> Select[T]:
         sort_field = getattr(cls, sort._sort, None)
         if sort_field is None:
             raise HTTPException(422, f"Unknown sort field {sort._sort}")
 
-        return stmt.order_by(
-            sort_field.asc()
-            if sort._order.casefold() == "asc".casefold()
-            else sort_field.desc()
-        )
+        ascending = sort._order.casefold() == "asc".casefold()
+        stmt = stmt.order_by(ordered(sort_field, ascending))
+        if sort._sort != "id":
+            stmt = stmt.order_by(cls.id.asc() if ascending else cls.id.desc())
+
+        return stmt.execution_options(sort_key=(sort._sort, ascending))
+
+    @classmethod
+    def loaders(cls) -> list[ExecutableOption]:
+        return [
+            joinedload(cls.creator),
+            selectinload(cls.downloads),
+            selectinload(cls.illustrations),
+            selectinload(cls.tags),
+        ]
 
     @classmethod
     def select_one(cls, id: int) -> Select[tuple[Self]]:
-        return select(cls).filter_by(id=id)
+        return select(cls).options(*cls.loaders()).filter_by(id=id)
 
     @classmethod
     def select_all(
@@ -160,7 +195,10 @@ class Asset(Base):
         search: Annotated[AssetSearch, Depends()],
         sort: Annotated[AssetSort, Depends()],
     ) -> Select[tuple[Self]]:
-        stmt = select(cls)
+        stmt = select(cls).options(*cls.loaders())
         stmt = cls.search(stmt, search)
-        stmt = cls.sort(stmt, sort)
+        if sort._sort == "relevance":
+            stmt = cls.rank(stmt, search)
+        else:
+            stmt = cls.sort(stmt, sort)
         return stmt
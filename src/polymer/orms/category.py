@@ -4,9 +4,10 @@ from typing import Annotated, Optional, Self, TypeVar
 from fastapi import Depends, HTTPException, Query
 from sqlalchemy import ForeignKey, Select, select
 from sqlalchemy.ext.associationproxy import AssociationProxy, association_proxy
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import Mapped, load_only, mapped_column, relationship, selectinload
+from sqlalchemy.sql.base import ExecutableOption
 
-from ._base import Base
+from ._base import Base, ordered
 
 T = TypeVar("T")
 
@@ -27,7 +28,7 @@ class CategorySort:
 class Category(Base):
     __tablename__ = "category"
     id: Mapped[int] = mapped_column(primary_key=True)
-    parent_id: Mapped[int | None] = mapped_column(ForeignKey("category.id"))
+    parent_id: Mapped[int | None] = mapped_column(ForeignKey("category.id"), index=True)
     label: Mapped[str]
 
     children: Mapped[list["Category"]] = relationship(back_populates="parent")
@@ -53,15 +54,20 @@ class Category(Base):
         if sort_field is None:
             raise HTTPException(422, f"Unknown sort field {sort._sort}")
 
-        return stmt.order_by(
-            sort_field.asc()
-            if sort._order.casefold() == "asc".casefold()
-            else sort_field.desc()
-        )
+        ascending = sort._order.casefold() == "asc".casefold()
+        stmt = stmt.order_by(ordered(sort_field, ascending))
+        if sort._sort != "id":
+            stmt = stmt.order_by(cls.id.asc() if ascending else cls.id.desc())
+
+        return stmt.execution_options(sort_key=(sort._sort, ascending))
+
+    @classmethod
+    def loaders(cls) -> list[ExecutableOption]:
+        return [selectinload(cls.children).options(load_only(Category.id))]
 
     @classmethod
     def select_one(cls, id: int) -> Select[tuple[Self]]:
-        return select(cls).filter_by(id=id)
+        return select(cls).options(*cls.loaders()).filter_by(id=id)
 
     @classmethod
     def select_all(
@@ -69,7 +75,7 @@ class Category(Base):
         search: Annotated[CategorySearch, Depends()],
         sort: Annotated[CategorySort, Depends()],
     ) -> Select[tuple[Self]]:
-        stmt = select(cls)
+        stmt = select(cls).options(*cls.loaders())
         stmt = cls.search(stmt, search)
         stmt = cls.sort(stmt, sort)
         return stmt
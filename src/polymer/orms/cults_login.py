@@ -0,0 +1,23 @@
+import datetime
+from typing import Any, Self
+
+from sqlalchemy import JSON, Select, select
+from sqlalchemy.orm import Mapped, mapped_column
+
+from ._base import Base
+
+
+class CultsLogin(Base):
+    __tablename__ = "cults_login"
+    email: Mapped[str] = mapped_column(primary_key=True)
+    cookies: Mapped[list[dict[str, Any]]] = mapped_column(JSON)
+    logged_in_at: Mapped[datetime.datetime]
+    checked_at: Mapped[datetime.datetime | None]
+
+    @property
+    def id(self) -> str:
+        return self.email
+
+    @classmethod
+    def select_one(cls) -> Select[tuple[Self]]:
+        return select(cls)
@@ -1,17 +1,15 @@
 import datetime
 from dataclasses import dataclass
 from pathlib import Path
-from typing import TYPE_CHECKING, Annotated, Self, TypeVar
+from typing import Annotated, Self, TypeVar
 
 from fastapi import Depends, HTTPException, Query
-from sqlalchemy import ForeignKey, Select, func, select
-from sqlalchemy.orm import Mapped, mapped_column, relationship
-
-from ._base import Base
-
-if TYPE_CHECKING:
-    from .asset import Asset
+from sqlalchemy import BigInteger, ForeignKey, Select, func, select
+from sqlalchemy.orm import Mapped, joinedload, mapped_column, relationship
+from sqlalchemy.sql.base import ExecutableOption
 
+from ._base import Base, ordered
+from .asset import Asset, AssetSearch
 
 T = TypeVar("T")
 
@@ -32,8 +30,10 @@ class DownloadSort:
 class Download(Base):
     __tablename__ = "download"
     id: Mapped[int] = mapped_column(primary_key=True)
-    asset_id: Mapped[str] = mapped_column(ForeignKey("asset.id"))
+    asset_id: Mapped[str] = mapped_column(ForeignKey("asset.id"), index=True)
     filename: Mapped[str]
+    size: Mapped[int | None] = mapped_column(BigInteger)
+    sha256: Mapped[str | None]
     downloaded_at: Mapped[datetime.datetime] = mapped_column(server_default=func.now())
 
     asset: Mapped["Asset"] = relationship(back_populates="downloads")
@@ -61,15 +61,20 @@ class Download(Base):
         if sort_field is None:
             raise HTTPException(422, f"Unknown sort field {sort._sort}")
 
-        return stmt.order_by(
-            sort_field.asc()
-            if sort._order.casefold() == "asc".casefold()
-            else sort_field.desc()
-        )
+        ascending = sort._order.casefold() == "asc".casefold()
+        stmt = stmt.order_by(ordered(sort_field, ascending))
+        if sort._sort != "id":
+            stmt = stmt.order_by(cls.id.asc() if ascending else cls.id.desc())
+
+        return stmt.execution_options(sort_key=(sort._sort, ascending))
+
+    @classmethod
+    def loaders(cls) -> list[ExecutableOption]:
+        return [joinedload(cls.asset)]
 
     @classmethod
     def select_one(cls, id: int) -> Select[tuple[Self]]:
-        return select(cls).filter_by(id=id)
+        return select(cls).options(*cls.loaders()).filter_by(id=id)
 
     @classmethod
     def select_all(
@@ -77,7 +82,25 @@ class Download(Base):
         search: Annotated[DownloadSearch, Depends()],
         sort: Annotated[DownloadSort, Depends()],
     ) -> Select[tuple[Self]]:
-        stmt = select(cls)
+        stmt = select(cls).options(*cls.loaders())
         stmt = cls.search(stmt, search)
         stmt = cls.sort(stmt, sort)
         return stmt
+
+    @classmethod
+    def select_bundle(
+        cls,
+        search: Annotated[AssetSearch, Depends()],
+        _after: int | None = None,
+    ) -> Select[tuple[Self]]:
+        # Newest download per matching asset, in a stable order to resume from
+        assets = Asset.search(select(Asset.id), search)
+        newest = (
+            select(func.max(cls.id))
+            .where(cls.asset_id.in_(assets.scalar_subquery()))
+            .group_by(cls.asset_id)
+        )
+        stmt = select(cls).options(*cls.loaders()).where(cls.id.in_(newest))
+        if _after is not None:
+            stmt = stmt.where(cls.id > _after)
+        return stmt.order_by(cls.id)
@@ -12,7 +12,7 @@ if TYPE_CHECKING:
 class Illustration(Base):
     __tablename__ = "illustration"
     id: Mapped[int] = mapped_column(primary_key=True)
-    asset_id: Mapped[str] = mapped_column(ForeignKey("asset.id"))
+    asset_id: Mapped[str] = mapped_column(ForeignKey("asset.id"), index=True)
     src: Mapped[str]
 
     asset: Mapped["Asset"] = relationship(back_populates="illustrations")
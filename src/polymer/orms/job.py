@@ -0,0 +1,65 @@
+import datetime
+from enum import StrEnum
+from typing import Self
+
+from sqlalchemy import ForeignKey, Index, Select, UniqueConstraint, func, select
+from sqlalchemy.orm import Mapped, mapped_column
+
+from ._base import Base
+
+
+class JobKind(StrEnum):
+    FREE_ORDER = "free_order"
+    DOWNLOAD = "download"
+
+
+class Job(Base):
+    __tablename__ = "job"
+    __table_args__ = (
+        # Finished jobs are kept, so each asset is only ordered or downloaded once
+        UniqueConstraint("kind", "asset_id"),
+        Index("ix_job_lease", "kind", "available_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str]
+    asset_id: Mapped[int] = mapped_column(ForeignKey("asset.id"))
+    priority: Mapped[int] = mapped_column(default=0)
+    attempts: Mapped[int] = mapped_column(default=0)
+    available_at: Mapped[datetime.datetime]
+    leased_until: Mapped[datetime.datetime | None]
+    leased_by: Mapped[str | None]
+    finished_at: Mapped[datetime.datetime | None]
+    failed_at: Mapped[datetime.datetime | None]
+    error: Mapped[str | None]
+    created_at: Mapped[datetime.datetime] = mapped_column(server_default=func.now())
+
+    def reset(self) -> None:
+        self.attempts = 0
+        self.available_at = datetime.datetime.utcnow()
+        self.leased_until = None
+        self.finished_at = None
+        self.failed_at = None
+        self.error = None
+
+    @classmethod
+    def select_one(cls, id: int) -> Select[tuple[Self]]:
+        return select(cls).filter_by(id=id)
+
+    @classmethod
+    def select_finished(cls, kind: JobKind, limit: int) -> Select[tuple[Self]]:
+        return (
+            select(cls)
+            .where(cls.kind == kind, cls.finished_at.is_not(None))
+            .order_by(cls.finished_at.desc())
+            .limit(limit)
+        )
+
+    @classmethod
+    def select_all(cls) -> Select[tuple[Self]]:
+        # Cursors seek on (priority, id), so both have to run the same way
+        return (
+            select(cls)
+            .order_by(cls.priority.desc(), cls.id.desc())
+            .execution_options(sort_key=("priority", False))
+        )
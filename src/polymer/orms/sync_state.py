@@ -0,0 +1,25 @@
+import datetime
+from typing import Self
+
+from sqlalchemy import Select, select
+from sqlalchemy.orm import Mapped, mapped_column
+
+from ._base import Base
+
+
+class SyncState(Base):
+    __tablename__ = "sync_state"
+    name: Mapped[str] = mapped_column(primary_key=True)
+    watermark: Mapped[str | None]
+    synced_at: Mapped[datetime.datetime | None]
+    reconciled_at: Mapped[datetime.datetime | None]
+    requests: Mapped[int] = mapped_column(default=0)
+    bytes: Mapped[int] = mapped_column(default=0)
+
+    @property
+    def id(self) -> str:
+        return self.name
+
+    @classmethod
+    def select_all(cls) -> Select[tuple[Self]]:
+        return select(cls).order_by(cls.name).execution_options(sort_key=("name", True))
@@ -5,8 +5,9 @@ from fastapi import Depends, HTTPException, Query
 from sqlalchemy import Select, select
 from sqlalchemy.ext.associationproxy import AssociationProxy, association_proxy
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.sql.base import ExecutableOption
 
-from ._base import Base, tag_association_table
+from ._base import Base, ordered, tag_association_table
 
 if TYPE_CHECKING:
     from .asset import Asset
@@ -31,7 +32,7 @@ class TagSort:
 class Tag(Base):
     __tablename__ = "tag"
     id: Mapped[int] = mapped_column(primary_key=True)
-    label: Mapped[str]
+    label: Mapped[str] = mapped_column(unique=True, index=True)
 
     assets: Mapped[list["Asset"]] = relationship(
         back_populates="tags", secondary=tag_association_table
@@ -54,15 +55,20 @@ class Tag(Base):
         if sort_field is None:
             raise HTTPException(422, f"Unknown sort field {sort._sort}")
 
-        return stmt.order_by(
-            sort_field.asc()
-            if sort._order.casefold() == "asc".casefold()
-            else sort_field.desc()
-        )
+        ascending = sort._order.casefold() == "asc".casefold()
+        stmt = stmt.order_by(ordered(sort_field, ascending))
+        if sort._sort != "id":
+            stmt = stmt.order_by(cls.id.asc() if ascending else cls.id.desc())
+
+        return stmt.execution_options(sort_key=(sort._sort, ascending))
+
+    @classmethod
+    def loaders(cls) -> list[ExecutableOption]:
+        return []
 
     @classmethod
     def select_one(cls, id: int) -> Select[tuple[Self]]:
-        return select(cls).filter_by(id=id)
+        return select(cls).options(*cls.loaders()).filter_by(id=id)
 
     @classmethod
     def select_all(
@@ -70,7 +76,7 @@ class Tag(Base):
         search: Annotated[TagSearch, Depends()],
         sort: Annotated[TagSort, Depends()],
     ) -> Select[tuple[Self]]:
-        stmt = select(cls)
+        stmt = select(cls).options(*cls.loaders())
         stmt = cls.search(stmt, search)
         stmt = cls.sort(stmt, sort)
         return stmt
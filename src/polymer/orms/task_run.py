@@ -0,0 +1,37 @@
+import datetime
+from enum import StrEnum
+from typing import Self
+
+from sqlalchemy import Index, Select, select
+from sqlalchemy.orm import Mapped, mapped_column
+
+from ._base import Base
+
+
+class TaskOutcome(StrEnum):
+    OK = "ok"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    SKIPPED = "skipped"
+
+
+class TaskRun(Base):
+    __tablename__ = "task_run"
+    __table_args__ = (Index("ix_task_run_name_started_at", "name", "started_at"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str]
+    started_at: Mapped[datetime.datetime] = mapped_column(index=True)
+    duration: Mapped[float | None]
+    outcome: Mapped[str]
+    error: Mapped[str | None]
+    items: Mapped[int | None]
+
+    @classmethod
+    def select_recent(cls, name: str, limit: int) -> Select[tuple[Self]]:
+        return (
+            select(cls)
+            .where(cls.name == name)
+            .order_by(cls.started_at.desc())
+            .limit(limit)
+        )
@@ -4,9 +4,10 @@ from typing import TYPE_CHECKING, Annotated, Self, TypeVar
 from fastapi import Depends, HTTPException, Query
 from sqlalchemy import Select, select
 from sqlalchemy.ext.associationproxy import AssociationProxy, association_proxy
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import Mapped, load_only, mapped_column, relationship, selectinload
+from sqlalchemy.sql.base import ExecutableOption
 
-from ._base import Base
+from ._base import Base, ordered
 
 if TYPE_CHECKING:
     from .asset import Asset
@@ -31,7 +32,7 @@ class UserSort:
 class User(Base):
     __tablename__ = "user"
     id: Mapped[int] = mapped_column(primary_key=True)
-    nickname: Mapped[str]
+    nickname: Mapped[str] = mapped_column(unique=True, index=True)
 
     assets: Mapped[list["Asset"]] = relationship(
         back_populates="creator", cascade="all, delete-orphan"
@@ -53,15 +54,22 @@ class User(Base):
         if sort_field is None:
             raise HTTPException(422, f"Unknown sort field {sort._sort}")
 
-        return stmt.order_by(
-            sort_field.asc()
-            if sort._order.casefold() == "asc".casefold()
-            else sort_field.desc()
-        )
+        ascending = sort._order.casefold() == "asc".casefold()
+        stmt = stmt.order_by(ordered(sort_field, ascending))
+        if sort._sort != "id":
+            stmt = stmt.order_by(cls.id.asc() if ascending else cls.id.desc())
+
+        return stmt.execution_options(sort_key=(sort._sort, ascending))
+
+    @classmethod
+    def loaders(cls) -> list[ExecutableOption]:
+        from .asset import Asset
+
+        return [selectinload(cls.assets).options(load_only(Asset.id))]
 
     @classmethod
     def select_one(cls, id: int) -> Select[tuple[Self]]:
-        return select(cls).filter_by(id=id)
+        return select(cls).options(*cls.loaders()).filter_by(id=id)
 
     @classmethod
     def select_all(
@@ -69,7 +77,7 @@ class User(Base):
         search: Annotated[UserSearch, Depends()],
         sort: Annotated[UserSort, Depends()],
     ) -> Select[tuple[Self]]:
-        stmt = select(cls)
+        stmt = select(cls).options(*cls.loaders())
         stmt = cls.search(stmt, search)
         stmt = cls.sort(stmt, sort)
         return stmt
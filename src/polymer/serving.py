@@ -0,0 +1,228 @@
+import io
+import mimetypes
+import os
+import re
+import time
+import zipfile
+from collections.abc import AsyncIterator, Iterator, Sequence
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Any
+from urllib.parse import quote
+
+import anyio
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+
+from .config import settings
+from .connectors.blobs import blob_store
+from .orms import Download
+
+RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+CHUNK_SIZE = 64 * 1024
+ZIP_EPOCH = 315532800  # 1980-01-01, the earliest time a zip entry can hold
+# Deflating these again costs CPU and saves nothing
+COMPRESSED = {
+    ".zip", ".3mf", ".7z", ".rar", ".gz", ".tgz", ".bz2", ".xz", ".zst",
+    ".png", ".jpg", ".jpeg", ".webp", ".gif", ".mp4",
+}  # fmt: skip
+
+
+def _content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # Weak comparison, as If-None-Match requires
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if (if_none_match := request.headers.get("If-None-Match")) is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if (if_modified_since := request.headers.get("If-Modified-Since")) is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+
+def _byte_range(request: Request, etag: str, mtime: float, size: int) -> range | None:
+    header = request.headers.get("Range")
+    if header is None:
+        return None
+
+    # A changed file gets sent whole rather than spliced
+    if (if_range := request.headers.get("If-Range")) is not None:
+        if if_range.startswith(('"', "W/")):
+            if etag.startswith("W/") or if_range != etag:
+                return None
+        elif if_range != formatdate(mtime, usegmt=True):
+            return None
+
+    # Multiple ranges are allowed to be answered with the whole file
+    match = RANGE.fullmatch(header.strip())
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        return None
+
+    if start > end or start >= size:
+        raise HTTPException(
+            416, "Range not satisfiable", {"Content-Range": f"bytes */{size}"}
+        )
+    return range(start, end + 1)
+
+
+async def _read_range(path: Path, span: range) -> AsyncIterator[bytes]:
+    async with await anyio.open_file(path, "rb") as f:
+        await f.seek(span.start)
+        remaining = len(span)
+        while remaining:
+            chunk = await f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def serve_file(
+    request: Request, path: Path, filename: str, sha256: str | None = None
+) -> Response:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        raise HTTPException(404, f"{filename} is missing from disk")
+
+    # Content hashes make strong validators, otherwise fall back to size and mtime
+    etag = f'"{sha256}"' if sha256 else f'W/"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": _content_disposition(filename),
+    }
+
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    # The proxy does the sending, and handles Range itself
+    match settings.file_offload:
+        case "x-accel-redirect":
+            relative = path.relative_to(settings.download_dir).as_posix()
+            headers["X-Accel-Redirect"] = settings.file_offload_prefix + quote(relative)
+            return Response(headers=headers, media_type=media_type)
+        case "x-sendfile":
+            headers["X-Sendfile"] = os.fspath(path.resolve())
+            return Response(headers=headers, media_type=media_type)
+
+    span = _byte_range(request, etag, stat.st_mtime, stat.st_size)
+    if span is None:
+        return FileResponse(
+            path, headers=headers, media_type=media_type, stat_result=stat
+        )
+
+    headers["Content-Range"] = f"bytes {span.start}-{span.stop - 1}/{stat.st_size}"
+    headers["Content-Length"] = str(len(span))
+    return StreamingResponse(
+        _read_range(path, span), 206, headers=headers, media_type=media_type
+    )
+
+
+def download_path(download: Download) -> Path:
+    path = Path(settings.download_dir, download.path)
+    # The slug tree is only links, the blob is the source of truth
+    if download.sha256 and not path.exists():
+        path = blob_store.path(download.sha256)
+    return path
+
+
+def serve_download(request: Request, download: Download) -> Response:
+    return serve_file(
+        request, download_path(download), download.filename, download.sha256
+    )
+
+
+class _Sink(io.RawIOBase):
+    # Unseekable on purpose, zipfile then streams entries with data descriptors
+    def __init__(self) -> None:
+        self.chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b: Any) -> int:
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> list[bytes]:
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def on_disk(downloads: Sequence[Download]) -> tuple[list[Download], list[int]]:
+    # Checked before any bytes go out, a missing file mid-stream truncates the zip
+    present, missing = [], []
+    for download in downloads:
+        try:
+            download_path(download).stat()
+        except FileNotFoundError:
+            missing.append(download.id)
+        else:
+            present.append(download)
+    return present, missing
+
+
+def _bundle(entries: list[tuple[Path, str]]) -> Iterator[bytes]:
+    # Sync so Starlette runs it in a worker thread, file reads included
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as bundle:
+        for path, arcname in entries:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # Deleted since on_disk() looked, leave it out like the rest
+                continue
+            info = zipfile.ZipInfo(
+                arcname, time.localtime(max(stat.st_mtime, ZIP_EPOCH))[:6]
+            )
+            info.file_size = stat.st_size
+            info.compress_type = (
+                zipfile.ZIP_STORED
+                if Path(arcname).suffix.lower() in COMPRESSED
+                else zipfile.ZIP_DEFLATED
+            )
+
+            # Known sizes let zipfile decide on zip64 up front
+            with path.open("rb") as src, bundle.open(info, "w") as dst:
+                while block := src.read(CHUNK_SIZE):
+                    dst.write(block)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+def serve_bundle(downloads: list[Download], missing: list[int]) -> Response:
+    entries = [(download_path(d), f"{d.asset.slug}/{d.filename}") for d in downloads]
+    headers = {"Content-Disposition": _content_disposition("polymer-bundle.zip")}
+    if missing:
+        headers["X-Missing-Downloads"] = ",".join(map(str, missing))
+    return StreamingResponse(
+        _bundle(entries), media_type="application/zip", headers=headers
+    )
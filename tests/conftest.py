@@ -0,0 +1,64 @@
+import os
+import tempfile
+from collections.abc import AsyncIterator
+
+import httpx
+import pytest
+
+# Settings are read at import time, so these have to be in place first
+ROOT = tempfile.mkdtemp(prefix="polymer-tests-")
+os.environ.update(
+    DB_URL=f"sqlite:///{ROOT}/polymer.db",
+    DOWNLOAD_DIR=f"{ROOT}/downloads",
+    EMAIL="tests@example.com",
+    PASSWORD="password",
+    NICKNAME="tests",
+    APIKEY="apikey",
+    MMF_CLIENT_ID="client",
+    MMF_CLIENT_SECRET="secret",
+)
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+def catalog() -> None:
+    from sqlalchemy.orm import Session
+
+    from polymer.orms import Asset, Base, Download, Illustration, Tag, User, engine
+
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        users = [User(nickname=f"maker-{i}") for i in range(5)]
+        tags = [Tag(label=f"tag-{i}") for i in range(10)]
+        for i in range(120):
+            asset = Asset(
+                name=f"Model {i}",
+                slug=f"model-{i}",
+                details="",
+                description="A dragon" if i % 3 == 0 else "A vase",
+                cents=0 if i % 2 else 250,
+                yanked=False,
+                creator=users[i % 5],
+                tags=[tags[i % 10], tags[(i + 1) % 10]],
+                illustrations=[Illustration(src=f"https://example.com/{i}.png")],
+            )
+            if i % 4 == 0:
+                # Sizes are only known for some, so sorts have NULLs to page over
+                size = 1000 - i if i % 8 == 0 else None
+                asset.downloads.append(Download(filename=f"model-{i}.zip", size=size))
+            session.add(asset)
+        session.commit()
+
+
+@pytest.fixture
+async def client(catalog: None) -> AsyncIterator[httpx.AsyncClient]:
+    from polymer.app import app
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://polymer"
+    ) as client:
+        yield client
@@ -0,0 +1,65 @@
+import hashlib
+import os
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+import httpx
+import pytest
+
+from polymer.config import settings
+from polymer.connectors.blobs import BlobStore
+from polymer.connectors.cults_client import CultsClient
+
+BODY = b"polymer" * 10_000
+URL = "https://files.cults3d.com/download/benchy"
+
+
+async def _chunks() -> AsyncIterator[bytes]:
+    for start in range(0, len(BODY), 4096):
+        yield BODY[start : start + 4096]
+
+
+def _chunked(request: httpx.Request) -> httpx.Response:
+    # An async body is sent chunked, without a Content-Length
+    return httpx.Response(
+        200,
+        headers={"Content-Disposition": 'attachment; filename="benchy.zip"'},
+        content=_chunks(),
+    )
+
+
+@pytest.mark.anyio
+async def test_download_without_content_length() -> None:
+    async with httpx.AsyncClient(transport=httpx.MockTransport(_chunked)) as http:
+        client = CultsClient(http)
+        result = await client._download_order("benchy", URL)
+        # A second run must not mistake the existing file for a finished download
+        again = await client._download_order("benchy", URL)
+
+    dest = Path(settings.download_dir, "benchy", "benchy.zip")
+    assert dest.read_bytes() == BODY
+    assert result.size == again.size == len(BODY)
+    assert result.sha256 == again.sha256 == hashlib.sha256(BODY).hexdigest()
+
+
+def test_unadopted_without_download_dir(tmp_path: Path) -> None:
+    assert list(BlobStore(tmp_path / "missing").unadopted()) == []
+
+
+def test_symlink_fallback_with_relative_root(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def no_hardlinks(src: object, dst: object) -> None:
+        raise OSError("hardlinks not supported")
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(os, "link", no_hardlinks)
+    store = BlobStore(Path("tmp"))
+    src = Path("tmp", ".partial", "benchy.part")
+    src.parent.mkdir(parents=True)
+    src.write_bytes(BODY)
+
+    dest = Path("tmp", "benchy", "benchy.zip")
+    store.publish(src, hashlib.sha256(BODY).hexdigest(), dest)
+    assert dest.is_symlink()
+    assert dest.read_bytes() == BODY
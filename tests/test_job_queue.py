@@ -0,0 +1,170 @@
+import asyncio
+import datetime
+from asyncio import Queue
+from collections.abc import Iterator
+
+import pytest
+from sqlalchemy import delete, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from polymer.components.actor import Actor
+from polymer.components.ingester import Ingester
+from polymer.components.job_queue import JobQueue
+from polymer.config import settings
+from polymer.connectors.cults_models import OrderFromCults
+from polymer.orms import Asset, Job, JobKind, engine
+
+
+@pytest.fixture
+def session(catalog: None) -> Iterator[Session]:
+    with Session(engine) as session:
+        session.execute(delete(Job))
+        session.commit()
+        yield session
+
+
+def order(slug: str, url: str) -> OrderFromCults:
+    return OrderFromCults.model_validate(
+        {
+            "creation": {
+                "name": slug,
+                "slug": slug,
+                "details": "",
+                "description": "",
+                "price": {"cents": 0},
+                "creator": {"nick": "maker-0"},
+                "illustrations": [],
+                "tags": [],
+            },
+            "downloadUrl": url,
+        }
+    )
+
+
+def enqueue_download(queue: JobQueue, slug: str) -> int:
+    return queue.enqueue(
+        JobKind.DOWNLOAD, Asset.slug == slug, Asset.download_url.is_not(None)
+    )
+
+
+def test_new_url_rearms_parked_download(
+    session: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "job_max_attempts", 1)
+    ingester = Ingester(session, Queue())
+    queue = JobQueue(session)
+
+    ingester.ingest([order("rearm", "https://files.cults3d.com/expired")])
+    assert enqueue_download(queue, "rearm") == 1
+    job = queue.lease("worker", [JobKind.DOWNLOAD])
+    queue.fail(job, "HTTPStatusError(403)")
+    assert job.failed_at is not None
+    assert queue.lease("worker", [JobKind.DOWNLOAD]) is None
+
+    counts = ingester.ingest([order("rearm", "https://files.cults3d.com/fresh")])
+    assert counts.download_urls == 1
+    # The existing row is reused rather than a second job inserted
+    assert enqueue_download(queue, "rearm") == 0
+
+    again = queue.lease("worker", [JobKind.DOWNLOAD])
+    assert again is not None and again.id == job.id
+    assert again.attempts == 1
+    assert again.failed_at is None and again.error is None
+
+
+@pytest.mark.anyio
+async def test_worker_survives_failed_completion(
+    session: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "job_poll_interval", 0.01)
+    monkeypatch.setattr(settings, "job_lease", 0.05)
+    Ingester(session, Queue()).ingest([order("flaky", "https://files.cults3d.com/a")])
+    queue = JobQueue(session)
+    enqueue_download(queue, "flaky")
+
+    actor = Actor(None, session, queue)
+    performed = []
+
+    async def perform(job: Job) -> None:
+        performed.append(job.id)
+
+    complete = queue.complete
+
+    def flaky_complete(job: Job) -> None:
+        # The first commit fails like a dropped connection would
+        if len(performed) == 1:
+            raise OperationalError("COMMIT", {}, Exception("connection reset"))
+        complete(job)
+
+    monkeypatch.setattr(actor, "_perform", perform)
+    monkeypatch.setattr(queue, "complete", flaky_complete)
+
+    worker = asyncio.create_task(actor.work(0))
+    await asyncio.sleep(0.5)
+    assert not worker.done()
+    worker.cancel()
+
+    # Picked up again once the lease lapsed, then recorded
+    assert len(performed) == 2
+    job = session.scalars(select(Job)).one()
+    assert job.finished_at is not None
+
+
+def test_lease_order_and_visibility(session: Session) -> None:
+    queue = JobQueue(session)
+    assert queue.enqueue(JobKind.DOWNLOAD, Asset.id.in_([1, 2])) == 2
+    assert queue.enqueue(JobKind.DOWNLOAD, Asset.id == 3, priority=1) == 1
+    # Already queued assets are not queued twice
+    assert queue.enqueue(JobKind.DOWNLOAD, Asset.id.in_([1, 2, 3])) == 0
+
+    leased = [queue.lease("worker", [JobKind.DOWNLOAD]) for _ in range(3)]
+    assert [job.asset_id for job in leased] == [3, 1, 2]
+    assert queue.lease("worker", [JobKind.DOWNLOAD]) is None
+    assert queue.lease("worker", [JobKind.FREE_ORDER]) is None
+
+    # Only the holder can extend its lease
+    assert queue.extend(leased[0], "worker")
+    assert not queue.extend(leased[0], "other")
+
+    # A lapsed lease hands the job to the next worker
+    leased[1].leased_until = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    session.commit()
+    again = queue.lease("other", [JobKind.DOWNLOAD])
+    assert again.id == leased[1].id
+    assert again.leased_by == "other" and again.attempts == 2
+
+    queue.complete(again)
+    assert again.finished_at is not None and again.leased_until is None
+    again.leased_until = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    session.commit()
+    assert queue.lease("worker", [JobKind.DOWNLOAD]) is None
+
+
+def test_fail_backs_off_then_parks(
+    session: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "job_max_attempts", 3)
+    monkeypatch.setattr(settings, "job_retry_base", 60)
+    queue = JobQueue(session)
+    queue.enqueue(JobKind.DOWNLOAD, Asset.id == 1)
+
+    for attempt, delay in ((1, 60), (2, 120)):
+        job = queue.lease("worker", [JobKind.DOWNLOAD])
+        assert job.attempts == attempt
+        before = datetime.datetime.utcnow()
+        queue.fail(job, "ReadTimeout()")
+        assert job.failed_at is None and job.leased_until is None
+        assert job.error == "ReadTimeout()"
+        assert job.available_at >= before + datetime.timedelta(seconds=delay)
+        assert job.available_at < before + datetime.timedelta(seconds=delay + 5)
+
+        # Hidden until the backoff is over
+        assert queue.lease("worker", [JobKind.DOWNLOAD]) is None
+        job.available_at = before
+        session.commit()
+
+    job = queue.lease("worker", [JobKind.DOWNLOAD])
+    queue.fail(job, "ReadTimeout()")
+    assert job.attempts == 3 and job.failed_at is not None
+    assert queue.lease("worker", [JobKind.DOWNLOAD]) is None
@@ -0,0 +1,24 @@
+import fcntl
+
+import httpx
+import pytest
+
+from polymer.lifespan import election
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "path", ["/api/tasks", "/api/actor", "/api/limits", "/api/caches"]
+)
+async def test_follower_defers_to_leader(client: httpx.AsyncClient, path: str) -> None:
+    # Another process holds the lock and has written its id into it
+    with election.lock_path().open("a+") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        lock.truncate(0)
+        lock.write("leader-host:1")
+        lock.flush()
+
+        res = await client.get(path)
+
+    assert res.status_code == 409
+    assert "leader-host:1" in res.json()["detail"]
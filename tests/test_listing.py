@@ -0,0 +1,84 @@
+from collections.abc import Iterator
+
+import httpx
+import pytest
+from sqlalchemy import event
+
+from polymer.connectors.db import count_cache
+from polymer.orms import async_engine
+
+
+@pytest.fixture
+def statements() -> Iterator[list[str]]:
+    executed: list[str] = []
+
+    def record(conn, cursor, statement, parameters, context, executemany) -> None:
+        executed.append(statement)
+
+    count_cache.entries.clear()
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("size", [1, 10, 100])
+async def test_asset_page_query_count(
+    client: httpx.AsyncClient, statements: list[str], size: int
+) -> None:
+    res = await client.get("/api/assets", params={"_start": 0, "_end": size})
+
+    assert res.status_code == 200
+    assert len(res.json()) == size
+    # count, page, then one selectin each for downloads, illustrations and tags
+    assert len(statements) == 5
+
+
+@pytest.mark.anyio
+async def test_cursor_page_query_count(
+    client: httpx.AsyncClient, statements: list[str]
+) -> None:
+    cursor = ""
+    for _ in range(3):
+        statements.clear()
+        res = await client.get("/api/assets", params={"_cursor": cursor, "_limit": 25})
+        cursor = res.headers["X-Next-Cursor"]
+
+        # Later pages reuse the cached count
+        pages = [s for s in statements if not s.startswith("SELECT count(*)")]
+        assert len(res.json()) == 25
+        assert len(pages) == 4
+
+
+async def walk(client: httpx.AsyncClient, path: str, **params: object) -> list[int]:
+    ids: list[int] = []
+    cursor = ""
+    while cursor is not None:
+        res = await client.get(path, params={**params, "_cursor": cursor, "_limit": 7})
+        assert res.status_code == 200, res.text
+        ids += [item["id"] for item in res.json()]
+        cursor = res.headers.get("X-Next-Cursor")
+    return ids
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("order", ["ASC", "DESC"])
+async def test_cursor_pages_over_nulls(client: httpx.AsyncClient, order: str) -> None:
+    # Only some downloads have a size, the rest sort after them
+    everything = await client.get("/api/downloads")
+    ids = await walk(client, "/api/downloads", _sort="size", _order=order)
+    assert sorted(ids) == sorted(d["id"] for d in everything.json())
+    assert len(ids) == len(set(ids))
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("cursor", ["MQ==", "WzEsIDJd", "not base64", "W251bGxd"])
+async def test_malformed_cursor(client: httpx.AsyncClient, cursor: str) -> None:
+    res = await client.get("/api/assets", params={"_cursor": cursor})
+    assert res.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_offset_page_end_before_start(client: httpx.AsyncClient) -> None:
+    res = await client.get("/api/assets", params={"_start": 10, "_end": 5})
+    assert res.status_code == 422
@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy import Select, select
+
+from polymer.orms import Asset, Download, Illustration, Tag, User, engine
+from polymer.orms.asset import AssetSearch, AssetSort
+
+
+def plan(stmt: Select) -> list[str]:
+    compiled = stmt.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").all()
+    return [row[-1] for row in rows]
+
+
+def listing(**search: object) -> Select:
+    return Asset.select_all(AssetSearch(**search), AssetSort())
+
+
+@pytest.mark.parametrize(
+    "stmt, expected",
+    [
+        # Ingester lookups
+        (select(Asset.id).where(Asset.slug.in_(["model-1"])), "INDEX ix_asset_slug"),
+        (select(Tag.id).where(Tag.label.in_(["tag-1"])), "INDEX ix_tag_label"),
+        (
+            select(User.id).where(User.nickname.in_(["maker-1"])),
+            "INDEX ix_user_nickname",
+        ),
+        # Eager loads behind every listing page
+        (
+            select(Download).where(Download.asset_id.in_([1, 2])),
+            "INDEX ix_download_asset_id",
+        ),
+        (
+            select(Illustration).where(Illustration.asset_id.in_([1, 2])),
+            "INDEX ix_illustration_asset_id",
+        ),
+        # Listing filters
+        (listing(creator_id=1), "INDEX ix_asset_creator_id"),
+        (listing(downloaded=True), "INDEX ix_download_asset_id"),
+        (listing(tag_id=1), "SEARCH tag_association_table USING"),
+        (listing(q="dragon"), "SCAN asset_fts VIRTUAL TABLE INDEX"),
+    ],
+)
+def test_query_uses_index(catalog: None, stmt: Select, expected: str) -> None:
+    details = plan(stmt)
+    assert any(expected in detail for detail in details), details
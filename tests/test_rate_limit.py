@@ -0,0 +1,138 @@
+import asyncio
+import time
+from collections.abc import Callable
+from email.utils import formatdate
+
+import httpx
+import pytest
+
+from polymer.config import settings
+from polymer.connectors import rate_limit
+from polymer.connectors.rate_limit import RateLimitedTransport, _retry_after
+
+URL = "https://cults3d.com/graphql"
+Handler = Callable[[httpx.Request], httpx.Response]
+
+
+@pytest.fixture(autouse=True)
+def fast(monkeypatch: pytest.MonkeyPatch) -> None:
+    # A fresh limiter per test, fast enough that only the retries wait
+    monkeypatch.setattr(rate_limit, "limiters", {})
+    monkeypatch.setattr(settings, "http_retries", 2)
+    monkeypatch.setattr(settings, "http_backoff_base", 0.01)
+    monkeypatch.setattr(settings, "http_backoff_max", 0.01)
+    monkeypatch.setattr(settings, "rate_limit_rate", 1000.0)
+    monkeypatch.setattr(settings, "rate_limit_min", 100.0)
+    monkeypatch.setattr(settings, "rate_limit_max", 1000.0)
+
+
+def replies(*responses: httpx.Response | Exception) -> tuple[Handler, list[float]]:
+    pending = list(responses)
+    sent: list[float] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append(time.monotonic())
+        reply = pending.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    return handler, sent
+
+
+def client(handler: Handler) -> httpx.AsyncClient:
+    transport = RateLimitedTransport(httpx.MockTransport(handler))
+    return httpx.AsyncClient(transport=transport)
+
+
+@pytest.mark.anyio
+async def test_retries_throttled_and_server_errors() -> None:
+    handler, sent = replies(
+        httpx.Response(429), httpx.Response(502), httpx.Response(200, text="ok")
+    )
+    async with client(handler) as http:
+        res = await http.get(URL)
+
+    assert res.status_code == 200 and res.text == "ok"
+    assert len(sent) == 3
+    limiter = rate_limit.limiters["cults3d.com"]
+    assert (limiter.retries, limiter.throttled, limiter.errors) == (2, 1, 1)
+    assert limiter.rate < settings.rate_limit_rate
+
+
+@pytest.mark.anyio
+async def test_gives_up_after_retries() -> None:
+    handler, sent = replies(*[httpx.Response(503)] * 3)
+    async with client(handler) as http:
+        res = await http.get(URL)
+
+    assert res.status_code == 503
+    assert len(sent) == settings.http_retries + 1
+
+
+@pytest.mark.anyio
+async def test_network_errors_are_retried() -> None:
+    handler, sent = replies(httpx.ConnectError("reset"), httpx.Response(200))
+    async with client(handler) as http:
+        res = await http.get(URL)
+    assert res.status_code == 200 and len(sent) == 2
+
+    handler, sent = replies(*[httpx.ReadTimeout("slow")] * 3)
+    async with client(handler) as http:
+        with pytest.raises(httpx.ReadTimeout):
+            await http.get(URL)
+    assert len(sent) == 3
+
+
+@pytest.mark.anyio
+async def test_post_only_resent_when_throttled() -> None:
+    handler, sent = replies(httpx.Response(500))
+    async with client(handler) as http:
+        res = await http.post(URL, json={})
+    assert res.status_code == 500 and len(sent) == 1
+
+    handler, sent = replies(httpx.ConnectError("reset"))
+    async with client(handler) as http:
+        with pytest.raises(httpx.ConnectError):
+            await http.post(URL, json={})
+
+    # Refused without doing the work, so safe to send again
+    handler, sent = replies(httpx.Response(429), httpx.Response(200))
+    async with client(handler) as http:
+        res = await http.post(URL, json={})
+    assert res.status_code == 200 and len(sent) == 2
+
+    # Opted in
+    handler, sent = replies(httpx.Response(500), httpx.Response(200))
+    async with client(handler) as http:
+        res = await http.post(URL, json={}, extensions={"retry": True})
+    assert res.status_code == 200 and len(sent) == 2
+
+
+@pytest.mark.anyio
+async def test_retry_after_pauses_the_host() -> None:
+    throttled = httpx.Response(429, headers={"Retry-After": "0.3"})
+    handler, sent = replies(throttled, *[httpx.Response(200)] * 3)
+    async with client(handler) as http:
+        retried = asyncio.create_task(http.get(URL))
+        await asyncio.sleep(0.05)
+        # Held back with the retry rather than sent into the throttling
+        await http.get(URL)
+        await retried
+        assert all(at - sent[0] >= 0.3 for at in sent[1:])
+
+        # Other hosts keep their own limiter
+        await http.get("https://files.cults3d.com/download/benchy")
+    assert set(rate_limit.limiters) == {"cults3d.com", "files.cults3d.com"}
+
+
+def test_retry_after_values() -> None:
+    def parse(value: str) -> float | None:
+        return _retry_after(httpx.Response(429, headers={"Retry-After": value}))
+
+    assert parse("120") == 120
+    assert parse("-5") == 0
+    assert parse("soon") is None
+    assert parse(formatdate(usegmt=True)) == pytest.approx(0, abs=1)
+    assert parse(formatdate(time.time() + 60, usegmt=True)) == pytest.approx(60, abs=2)
+    assert _retry_after(httpx.Response(429)) is None
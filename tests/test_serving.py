@@ -0,0 +1,98 @@
+import io
+import zipfile
+from pathlib import Path
+
+import httpx
+import pytest
+
+from polymer.config import settings
+
+BODY = b"polymer" * 10_000
+
+
+@pytest.mark.anyio
+async def test_bundle_leaves_out_missing_files(client: httpx.AsyncClient) -> None:
+    # Assets 1 and 5 are model-0 and model-4, only the first is on disk
+    present = Path(settings.download_dir, "model-0", "model-0.zip")
+    present.parent.mkdir(parents=True, exist_ok=True)
+    present.write_bytes(b"benchy")
+    params = {"id": [1, 5]}
+
+    res = await client.get("/api/assets/bundle", params=params)
+    assert res.status_code == 200
+    assert res.headers["X-Missing-Downloads"]
+    with zipfile.ZipFile(io.BytesIO(res.content)) as bundle:
+        assert bundle.namelist() == ["model-0/model-0.zip"]
+        assert bundle.read("model-0/model-0.zip") == b"benchy"
+
+    res = await client.get("/api/assets/bundle/manifest", params=params)
+    assert [entry["path"] for entry in res.json()] == ["model-0/model-0.zip"]
+
+
+@pytest.fixture
+def benchy(catalog: None) -> Path:
+    # Asset 9 is model-8
+    path = Path(settings.download_dir, "model-8", "model-8.zip")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(BODY)
+    return path
+
+
+@pytest.mark.anyio
+async def test_download_range(client: httpx.AsyncClient, benchy: Path) -> None:
+    res = await client.get("/api/assets/9/download", headers={"Range": "bytes=10-19"})
+    assert res.status_code == 206
+    assert res.headers["Content-Range"] == f"bytes 10-19/{len(BODY)}"
+    assert res.content == BODY[10:20]
+
+    res = await client.get("/api/assets/9/download", headers={"Range": "bytes=-5"})
+    assert res.status_code == 206
+    assert res.content == BODY[-5:]
+
+    res = await client.get("/api/assets/9/download", headers={"Range": "bytes=5-"})
+    assert res.status_code == 206
+    assert res.content == BODY[5:]
+
+
+@pytest.mark.anyio
+async def test_download_range_not_satisfiable(
+    client: httpx.AsyncClient, benchy: Path
+) -> None:
+    headers = {"Range": f"bytes={len(BODY)}-"}
+    res = await client.get("/api/assets/9/download", headers=headers)
+    assert res.status_code == 416
+    assert res.headers["Content-Range"] == f"bytes */{len(BODY)}"
+
+
+@pytest.mark.anyio
+async def test_download_if_range(client: httpx.AsyncClient, benchy: Path) -> None:
+    res = await client.get("/api/assets/9/download")
+    assert res.status_code == 200
+    assert res.content == BODY
+    last_modified = res.headers["Last-Modified"]
+
+    headers = {"Range": "bytes=0-9", "If-Range": last_modified}
+    res = await client.get("/api/assets/9/download", headers=headers)
+    assert res.status_code == 206
+    assert res.content == BODY[:10]
+
+    # The file changed since, or the validator is weak, so it comes whole
+    for if_range in ("Thu, 01 Jan 1998 00:00:00 GMT", res.headers["ETag"]):
+        headers = {"Range": "bytes=0-9", "If-Range": if_range}
+        res = await client.get("/api/assets/9/download", headers=headers)
+        assert res.status_code == 200
+        assert res.content == BODY
+
+
+@pytest.mark.anyio
+async def test_download_not_modified(client: httpx.AsyncClient, benchy: Path) -> None:
+    res = await client.get("/api/assets/9/download")
+    etag, last_modified = res.headers["ETag"], res.headers["Last-Modified"]
+
+    for headers in ({"If-None-Match": etag}, {"If-Modified-Since": last_modified}):
+        res = await client.get("/api/assets/9/download", headers=headers)
+        assert res.status_code == 304
+        assert res.content == b""
+
+    res = await client.get("/api/assets/9/download", headers={"If-None-Match": '"x"'})
+    assert res.status_code == 200